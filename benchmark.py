@@ -0,0 +1,702 @@
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from config import EMBEDDING_BATCH_SIZE
+from chunker import chunk_elements, chunk_id
+from embedding import chunk_pdf_elements, chroma_metadata, batched
+from embedding_cache import encode_with_cache
+from element_cache import ElementCache
+from chunk_store import ChunkStore, ChunkStoreWriter
+from fact_index import FactIndex
+from llm_cache import LLMCache, CachedModel
+from filings import parse_filing_name
+from rag import rag_query
+from rag_agent import agentic_rag_query
+from vector_index import NumpyIndex, write_numpy_index
+
+# Offline benchmark harness for the ingest, retrieval and agent stages. Gemini is
+# replaced by a deterministic stub and the embedding model by synthetic vectors
+# (or a locally cached SentenceTransformer), so runs need no network access and
+# can be compared across commits via the JSON output.
+
+# Texts encoded before timing an encoder
+ENCODER_WARMUP = 32
+
+FILINGS = ['goog-10-k-2023.pdf', 'msft-10-k-2023.pdf', 'nvda-10-k-2024.pdf']
+
+WORDS = (
+    "revenue growth operating income gross margin fiscal year quarter segment cloud data center "
+    "advertising gaming research development expenses net income cash flow risk factors competition "
+    "regulation supply chain customers products services billion million percent increase decrease "
+    "compared prior period primarily driven higher lower demand investments infrastructure AI"
+).split()
+
+
+class SyntheticMetadata:
+    def __init__(self, data):
+        self.data = data
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+class SyntheticElement:
+    """Stand-in for an unstructured element: str() is its text, metadata.to_dict() its metadata."""
+
+    def __init__(self, text, page_number):
+        self.text = text
+        self.metadata = SyntheticMetadata({"page_number": page_number, "filetype": "application/pdf",
+                                           "languages": ["eng"], "coordinates": {"points": [[0, 0], [1, 1]]}})
+
+    def __str__(self):
+        return self.text
+
+
+def synthetic_text(rng, n_words):
+    return " ".join(rng.choice(WORDS) for _ in range(n_words)) + "."
+
+
+def synthetic_elements(rng, pages, elements_per_page):
+    return [SyntheticElement(synthetic_text(rng, rng.randint(8, 40)), page)
+            for page in range(1, pages + 1) for _ in range(elements_per_page)]
+
+
+class SyntheticEmbeddingModel:
+    """Deterministic offline embedding model: each text maps to a fixed random unit vector."""
+
+    def __init__(self, dim=768):
+        self.dim = dim
+
+    def vector(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+        vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def encode(self, texts, **kwargs):
+        if isinstance(texts, str):
+            return self.vector(texts)
+        return np.stack([self.vector(text) for text in texts]) if texts else np.zeros((0, self.dim), dtype=np.float32)
+
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubGenerativeModel:
+    """
+    Deterministic offline stand-in for genai.GenerativeModel.
+
+    Decomposition prompts get one sub-query per company mentioned in the query
+    (all three if none is), synthesis prompts a fixed JSON answer. `latency_ms`
+    simulates the network round trip; with stream=True it is spread over the
+    response's lines.
+    """
+
+    def __init__(self, latency_ms=0.0):
+        self.model_name = "stub"
+        self.latency = latency_ms / 1000.0
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        if not stream:
+            if self.latency:
+                time.sleep(self.latency)
+            return self.respond(prompt)
+        return self.stream_lines(self.respond(prompt).text.splitlines(keepends=True))
+
+    def stream_lines(self, lines):
+        for line in lines:
+            if self.latency:
+                time.sleep(self.latency / len(lines))
+            yield StubResponse(line)
+
+    def respond(self, prompt):
+        if "Provide the sub-queries as a numbered list." in prompt:
+            query = [line.strip() for line in prompt.split("Provide the sub-queries")[0].splitlines() if line.strip()][-1]
+            companies = [name for name in ("NVIDIA", "Google", "Microsoft") if name.lower() in query.lower()]
+            sub_queries = [f"{company}: {query}" for company in companies or ("NVIDIA", "Google", "Microsoft")]
+            return StubResponse("\n".join(f"{i}. {sub_query}" for i, sub_query in enumerate(sub_queries, start=1)))
+        return StubResponse(json.dumps({"answer": "Stub answer.", "reasoning": f"Prompt had {len(prompt)} characters."}))
+
+
+class FlakySynthesisModel(StubGenerativeModel):
+    """StubGenerativeModel whose first synthesis response is not valid JSON."""
+
+    def __init__(self):
+        super().__init__()
+        self.synthesis_calls = 0
+
+    def respond(self, prompt):
+        response = super().respond(prompt)
+        if "Provide the sub-queries as a numbered list." in prompt:
+            return response
+        self.synthesis_calls += 1
+        return StubResponse("Not JSON") if self.synthesis_calls == 1 else response
+
+
+class StageTimer:
+    """Proxy that accumulates the wall time spent in one method of the wrapped object."""
+
+    def __init__(self, target, method):
+        self.target = target
+        self.method = method
+        self.seconds = 0.0
+        self.calls = 0
+
+    def __getattr__(self, name):
+        if name == "target":
+            raise AttributeError(name)
+        attribute = getattr(self.target, name)
+        if name != self.method:
+            return attribute
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                self.seconds += time.perf_counter() - start
+                self.calls += 1
+        return timed
+
+    def reset(self):
+        self.seconds = 0.0
+        self.calls = 0
+
+
+def legacy_chunk_elements(elements, file_name, overlap_size=100):
+    """
+    The chunking loop formerly copied into chunking.py and embedding.py, kept as
+    the baseline for chunker.py: string += buffer, per-element header and
+    metadata copies. Chunk IDs and chunk_index are assigned afterwards, as ingest did.
+    """
+    company, fiscal_year = parse_filing_name(file_name)
+    year = fiscal_year if fiscal_year is not None else 'N/A'
+    chunks = []
+    current_chunk_text = ""
+    current_metadata = {}
+    for i, element in enumerate(elements):
+        element_text = str(element)
+        element_metadata = element.metadata.to_dict()
+        element_metadata['source'] = file_name
+        element_metadata['page_number'] = element_metadata.get('page_number', 'N/A')
+        element_metadata['company'] = company
+        if fiscal_year is not None:
+            element_metadata['fiscal_year'] = fiscal_year
+        header = f"This excerpt is from company {company} FY {year}.\n"
+        current_chunk_text += element_text + "\n"
+        current_metadata = element_metadata
+        if len(current_chunk_text) >= 300 or i == len(elements) - 1:
+            chunks.append({"content": header + current_chunk_text.strip(), "metadata": current_metadata})
+            current_chunk_text = current_chunk_text[-overlap_size:].lstrip()
+    if current_chunk_text.strip():
+        header = f"This excerpt is from company {company} FY {year}.\n"
+        chunks.append({"content": header + current_chunk_text.strip(), "metadata": current_metadata})
+    seen = {}
+    for index, chunk in enumerate(chunks):
+        occurrence = seen.get(chunk["content"], 0)
+        seen[chunk["content"]] = occurrence + 1
+        chunk["id"] = chunk_id(file_name, chunk["content"], occurrence)
+        chunk["metadata"] = dict(chunk["metadata"], chunk_index=index)
+    return chunks
+
+
+def bench_chunking(elements_by_file, repeats=5):
+    """Best-of-`repeats` time of the legacy chunking loop against chunker.py on the same element streams."""
+    variants = {
+        "legacy_loop": lambda elements, file_name: legacy_chunk_elements(elements, file_name),
+        "chunker_chars": lambda elements, file_name: list(chunk_elements(elements, file_name, unit='chars')),
+        "chunker_tokens": lambda elements, file_name: list(chunk_elements(elements, file_name, size=60, overlap=20, unit='tokens')),
+    }
+    results = {}
+    outputs = {}
+    for name, chunk in variants.items():
+        best = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            chunks = [chunk(elements, file_name) for file_name, elements in elements_by_file.items()]
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        outputs[name] = chunks
+        results[name] = {"seconds": best, "chunks": sum(len(file_chunks) for file_chunks in chunks)}
+    baseline = results["legacy_loop"]["seconds"]
+    for name in variants:
+        results[name]["speedup"] = baseline / results[name]["seconds"] if results[name]["seconds"] else None
+    # The chunker must reproduce the legacy chunk texts exactly, or existing chunk IDs would change
+    results["chunker_chars"]["matches_legacy"] = all(
+        [chunk["content"] for chunk in new] == [chunk["content"] for chunk in old]
+        for new, old in zip(outputs["chunker_chars"], outputs["legacy_loop"])
+    )
+    return results
+
+
+def latency_summary(samples):
+    """Mean and p50/p95/p99 of a list of durations in seconds, reported in milliseconds."""
+    if not samples:
+        return {}
+    samples_ms = np.asarray(samples) * 1000.0
+    return {
+        "count": len(samples),
+        "mean_ms": float(samples_ms.mean()),
+        "p50_ms": float(np.percentile(samples_ms, 50)),
+        "p95_ms": float(np.percentile(samples_ms, 95)),
+        "p99_ms": float(np.percentile(samples_ms, 99)),
+    }
+
+
+def synthetic_corpus(rng, size, embedding_model):
+    ids, documents, metadatas = [], [], []
+    for i in range(size):
+        file_name = FILINGS[i % len(FILINGS)]
+        company, year = file_name.split('-10-k-')
+        ids.append(f"{file_name}:{i}")
+        documents.append(f"This excerpt is from company {company.upper()} FY {year[:4]}.\n" + synthetic_text(rng, 60))
+        metadatas.append({"source": file_name, "page_number": i % 100 + 1,
+                          "company": company.upper(), "fiscal_year": int(year[:4])})
+    if isinstance(embedding_model, SyntheticEmbeddingModel):
+        # Random vectors directly: hashing tens of thousands of documents adds nothing to the measurement
+        vectors = np.random.default_rng(size).standard_normal((size, embedding_model.dim)).astype(np.float32)
+    else:
+        vectors = np.asarray(embedding_model.encode(documents, batch_size=EMBEDDING_BATCH_SIZE), dtype=np.float32)
+    return ids, documents, metadatas, vectors
+
+
+def bench_chunk_store(chunks, workdir, rng, lookups=1000):
+    """Write time and size of the chunk store against the former indented JSON dump, plus lookup and scan times."""
+    results = {}
+    start = time.perf_counter()
+    json_path = os.path.join(workdir, "chunks_with_metadata.json")
+    with open(json_path, "w") as f:
+        json.dump(chunks, f, indent=4)
+    results["json_dump"] = {"write_seconds": time.perf_counter() - start, "bytes": os.path.getsize(json_path)}
+
+    store_dir = os.path.join(workdir, "chunk_store")
+    start = time.perf_counter()
+    writer = ChunkStoreWriter(store_dir, rewrite=True)
+    for chunk in chunks:
+        writer.add(chunk)
+    writer.commit()
+    write_seconds = time.perf_counter() - start
+    store_bytes = sum(os.path.getsize(os.path.join(store_dir, name)) for name in os.listdir(store_dir))
+
+    start = time.perf_counter()
+    store = ChunkStore(store_dir)
+    open_seconds = time.perf_counter() - start
+    sample = [rng.choice(chunks)["id"] for _ in range(lookups)] if chunks else []
+    start = time.perf_counter()
+    found = sum(store.content(chunk_id) is not None for chunk_id in sample)
+    lookup_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    scanned = sum(1 for _ in store)
+    scan_seconds = time.perf_counter() - start
+    store.close()
+
+    results["chunk_store"] = {
+        "write_seconds": write_seconds, "bytes": store_bytes, "open_seconds": open_seconds,
+        "lookup_us": lookup_seconds / len(sample) * 1e6 if sample else None,
+        "scan_chunks_per_second": scanned / scan_seconds if scan_seconds else None,
+        "complete": found == len(sample) and scanned == len(chunks),
+    }
+    return results
+
+
+def load_queries(path):
+    with open(path, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def bench_ingest(args, embedding_model, workdir):
+    rng = random.Random(args.seed)
+    results = {"stages": {}}
+
+    # Partition: real PDFs only, and only when the unstructured stack is installed
+    elements_by_file = {}
+    pages = 0
+    if args.data_dir:
+        try:
+            from partitioning import partition_files
+            pdf_files = sorted(name for name in os.listdir(args.data_dir) if name.endswith('.pdf'))
+            start = time.perf_counter()
+            for file_name, (_, elements, error) in zip(pdf_files, partition_files([os.path.join(args.data_dir, name) for name in pdf_files], cache_dir=None)):
+                if error is None:
+                    elements_by_file[file_name] = elements
+                    pages += max((element.metadata.to_dict().get('page_number') or 0) for element in elements) if elements else 0
+            seconds = time.perf_counter() - start
+            results["stages"]["partition"] = {"seconds": seconds, "pages": pages,
+                                              "pages_per_second": pages / seconds if seconds else None}
+        except ImportError as e:
+            results["stages"]["partition"] = {"skipped": f"PDF stack not installed: {e}"}
+    if not elements_by_file:
+        for file_name in FILINGS:
+            elements_by_file[file_name] = synthetic_elements(rng, args.pages_per_filing, args.elements_per_page)
+        pages = args.pages_per_filing * len(FILINGS)
+    results["source"] = "pdf" if args.data_dir and "seconds" in results["stages"].get("partition", {}) else "synthetic"
+    results["pages"] = pages
+
+    # Element cache: what re-chunking costs instead of partitioning once the elements are cached
+    element_cache = ElementCache(os.path.join(workdir, "element_cache"))
+    start = time.perf_counter()
+    for file_name, elements in elements_by_file.items():
+        element_cache.put(file_name, elements)
+    store_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    cached_elements = {file_name: element_cache.get(file_name) for file_name in elements_by_file}
+    load_seconds = time.perf_counter() - start
+    cache_bytes = sum(os.path.getsize(element_cache.path(file_name)) for file_name in elements_by_file)
+    results["stages"]["element_cache"] = {
+        "store_seconds": store_seconds, "load_seconds": load_seconds, "bytes": cache_bytes,
+        "pages_per_second": pages / load_seconds if load_seconds else None,
+        # Cached elements must chunk exactly like the originals
+        "identical_chunks": all(
+            chunk_pdf_elements(cached_elements[file_name], file_name) == chunk_pdf_elements(elements, file_name)
+            for file_name, elements in elements_by_file.items()
+        ),
+    }
+
+    # Chunk
+    start = time.perf_counter()
+    chunks = []
+    for file_name, elements in elements_by_file.items():
+        chunks.extend(chunk_pdf_elements(elements, file_name))
+    seconds = time.perf_counter() - start
+    results["chunks"] = len(chunks)
+    results["stages"]["chunk"] = {"seconds": seconds, "pages_per_second": pages / seconds if seconds else None,
+                                  "chunks_per_second": len(chunks) / seconds if seconds else None}
+    results["chunking"] = bench_chunking(elements_by_file)
+    results["chunk_store"] = bench_chunk_store(chunks, workdir, rng)
+
+    # Embed
+    start = time.perf_counter()
+    vectors = []
+    for batch in batched(chunks, EMBEDDING_BATCH_SIZE):
+        vectors.append(encode_with_cache([chunk["content"] for chunk in batch], lambda: embedding_model))
+    vectors = np.concatenate(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+    seconds = time.perf_counter() - start
+    results["stages"]["embed"] = {"seconds": seconds, "chunks_per_second": len(chunks) / seconds if seconds else None}
+
+    # Index: metadata processing plus writing the vectors to each available store
+    ids = [chunk["id"] for chunk in chunks]
+    documents = [chunk["content"] for chunk in chunks]
+    start = time.perf_counter()
+    metadatas = [chroma_metadata(chunk["metadata"]) for chunk in chunks]
+    write_numpy_index(os.path.join(workdir, "ingest_index"), "benchmark", ids, documents, metadatas, vectors, "float16")
+    seconds = time.perf_counter() - start
+    results["stages"]["index_numpy"] = {"seconds": seconds, "chunks_per_second": len(chunks) / seconds if seconds else None}
+    try:
+        import chromadb
+        collection = chromadb.EphemeralClient().get_or_create_collection("benchmark_ingest")
+        start = time.perf_counter()
+        for i in range(0, len(ids), EMBEDDING_BATCH_SIZE):
+            collection.upsert(ids=ids[i:i + EMBEDDING_BATCH_SIZE], documents=documents[i:i + EMBEDDING_BATCH_SIZE],
+                              metadatas=metadatas[i:i + EMBEDDING_BATCH_SIZE],
+                              embeddings=vectors[i:i + EMBEDDING_BATCH_SIZE].tolist())
+        seconds = time.perf_counter() - start
+        results["stages"]["index_chroma"] = {"seconds": seconds, "chunks_per_second": len(chunks) / seconds if seconds else None}
+    except ImportError as e:
+        results["stages"]["index_chroma"] = {"skipped": f"chromadb not installed: {e}"}
+
+    total = sum(results["stages"][name]["seconds"] for name in ("partition", "chunk", "embed", "index_numpy")
+                if "seconds" in results["stages"].get(name, {}))
+    results["total"] = {"seconds": total, "pages_per_second": pages / total if total else None,
+                        "chunks_per_second": len(chunks) / total if total else None}
+    return results
+
+
+def bench_retrieval(args, embedding_model, workdir):
+    rng = random.Random(args.seed)
+    queries = load_queries(args.query_file)
+    results = []
+    for size in args.corpus_sizes:
+        ids, documents, metadatas, vectors = synthetic_corpus(rng, size, embedding_model)
+        backends = []
+        for dtype in args.index_dtypes:
+            index_dir = os.path.join(workdir, f"retrieval_{size}_{dtype}")
+            write_numpy_index(index_dir, "benchmark", ids, documents, metadatas, vectors, dtype)
+            start = time.perf_counter()
+            index = NumpyIndex(index_dir)
+            backends.append((f"numpy-{dtype}", index, time.perf_counter() - start))
+        if size <= args.chroma_max_size:
+            try:
+                import chromadb
+                collection = chromadb.EphemeralClient().get_or_create_collection(f"benchmark_{size}")
+                for i in range(0, size, 1000):
+                    collection.upsert(ids=ids[i:i + 1000], documents=documents[i:i + 1000],
+                                      metadatas=metadatas[i:i + 1000], embeddings=vectors[i:i + 1000].tolist())
+                backends.append(("chroma", collection, None))
+            except ImportError:
+                pass
+
+        for backend, collection, load_seconds in backends:
+            for n_results in args.n_results:
+                latencies = []
+                for i in range(args.queries):
+                    # Vary the text so every call pays for its own embedding
+                    query_text = f"{queries[i % len(queries)]} #{i}"
+                    start = time.perf_counter()
+                    rag_query(query_text, collection, embedding_model, n_results=n_results)
+                    latencies.append(time.perf_counter() - start)
+                point = {"backend": backend, "corpus_size": size, "n_results": n_results}
+                if load_seconds is not None:
+                    point["load_seconds"] = load_seconds
+                point.update(latency_summary(latencies))
+                results.append(point)
+                print(f"retrieval {backend:<14} size={size:<7} n_results={n_results:<3} p50={point['p50_ms']:.2f}ms p99={point['p99_ms']:.2f}ms")
+    return results
+
+
+# Line items of the synthetic fact index and the names queries use for each filing's company
+FACT_LINE_ITEMS = ('Total revenue', 'Net income', 'Operating income', 'Research and development')
+FACT_COMPANIES = {'GOOG': 'Google', 'MSFT': 'Microsoft', 'NVDA': 'NVIDIA'}
+
+
+def synthetic_fact_index(path, rng):
+    """Fills a FactIndex with one figure per filing, line item and year; returns lookup queries for them."""
+    fact_index = FactIndex(path)
+    queries = []
+    for file_name in FILINGS:
+        company, fiscal_year = parse_filing_name(file_name)
+        facts = []
+        for year in (fiscal_year - 1, fiscal_year):
+            for page, line_item in enumerate(FACT_LINE_ITEMS, start=40):
+                value = rng.randint(1000, 99999)
+                facts.append({"source": file_name, "company": company, "fiscal_year": fiscal_year,
+                              "line_item": line_item, "period": f"Year ended {year}", "period_year": year,
+                              "value": float(value), "value_text": f"${value:,}", "unit": "millions", "page": page})
+                queries.append(f"What was {FACT_COMPANIES[company]}'s {line_item.lower()} in fiscal {year}?")
+        fact_index.replace_file(file_name, facts)
+    return fact_index, queries
+
+
+def bench_agent(args, embedding_model, workdir):
+    rng = random.Random(args.seed)
+    ids, documents, metadatas, vectors = synthetic_corpus(rng, args.agent_corpus_size, embedding_model)
+    index_dir = os.path.join(workdir, "agent_index")
+    write_numpy_index(index_dir, "benchmark", ids, documents, metadatas, vectors, "float32")
+
+    collection = StageTimer(NumpyIndex(index_dir), "query")
+    timed_embedding_model = StageTimer(embedding_model, "encode")
+    decomposition_model = StageTimer(StubGenerativeModel(args.llm_latency_ms), "generate_content")
+    synthesis_model = StageTimer(StubGenerativeModel(args.llm_latency_ms), "generate_content")
+    timers = {"decomposition": decomposition_model, "embed": timed_embedding_model,
+              "search": collection, "synthesis": synthesis_model}
+
+    # Single-figure lookups, answered with and without the fact index
+    fact_index, lookup_queries = synthetic_fact_index(os.path.join(workdir, "facts.sqlite"), rng)
+
+    results = {"corpus_size": args.agent_corpus_size, "llm_latency_ms": args.llm_latency_ms}
+    modes = (("sequential", load_queries(args.query_file), False, None),
+             ("pipelined", load_queries(args.query_file), True, None),
+             ("lookups_without_fact_index", lookup_queries, False, None),
+             ("lookups_with_fact_index", lookup_queries, False, fact_index))
+    for mode, queries, pipelined, mode_fact_index in modes:
+        per_query = []
+        for query in queries:
+            for timer in timers.values():
+                timer.reset()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()): # agentic_rag_query is chatty
+                result = agentic_rag_query(query, collection, timed_embedding_model, decomposition_model, synthesis_model,
+                                           pipelined=pipelined, fact_index=mode_fact_index)
+            total = time.perf_counter() - start
+            # In pipelined mode stages overlap, so their times can add up to more than the total
+            stages = {name: timer.seconds for name, timer in timers.items()}
+            stages["other"] = total - sum(stages.values())
+            per_query.append({"query": query, "sub_queries": len(result["sub_queries"]),
+                              "llm_calls": decomposition_model.calls + synthesis_model.calls,
+                              "total_seconds": total, "stage_seconds": stages})
+
+        summary = {"total": latency_summary([entry["total_seconds"] for entry in per_query]),
+                   "llm_calls": sum(entry["llm_calls"] for entry in per_query)}
+        for name in list(timers) + ["other"]:
+            summary[name] = latency_summary([entry["stage_seconds"][name] for entry in per_query])
+        results[mode] = {"summary": summary, "queries": per_query}
+
+    results["bad_synthesis_retry"] = check_bad_synthesis_retry(load_queries(args.query_file)[0], collection,
+                                                               timed_embedding_model, workdir)
+    return results
+
+
+def check_bad_synthesis_retry(query, collection, embedding_model, workdir):
+    """
+    Runs a query twice through the LLM cache with a synthesis model whose first
+    response can't be parsed. The failed result must be marked as an error and
+    must not be cached, so the rerun calls the model again and succeeds.
+    """
+    cache = LLMCache(os.path.join(workdir, "retry_llm_cache.sqlite"))
+    synthesis_model = FlakySynthesisModel()
+    errors = []
+    for _ in range(2):
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = agentic_rag_query(query, collection, embedding_model, CachedModel(StubGenerativeModel(), cache),
+                                       CachedModel(synthesis_model, cache))
+        errors.append(bool(result.get("error")))
+    return {"synthesis_calls": synthesis_model.synthesis_calls, "errors": errors,
+            "retried": synthesis_model.synthesis_calls == 2 and errors == [True, False]}
+
+
+def top_k(document_vectors, query_vectors, k):
+    document_vectors = document_vectors / np.linalg.norm(document_vectors, axis=1, keepdims=True)
+    query_vectors = query_vectors / np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    return np.argsort(-(query_vectors @ document_vectors.T), axis=1)[:, :k]
+
+
+def bench_encoder(args):
+    """
+    Encoding throughput of each ENCODER_BACKEND, and how closely its top-k
+    matches the reference SentenceTransformer on the same corpus and queries.
+    Needs sentence-transformers and, for the ONNX backends, onnxruntime.
+    """
+    try:
+        from fast_encoder import load_encoder, ParallelEncoder
+        reference = load_encoder('sentence_transformers')
+    except ImportError as e:
+        return {"skipped": f"sentence-transformers not installed: {e}"}
+
+    rng = random.Random(args.seed)
+    documents = synthetic_corpus(rng, args.encoder_corpus_size, SyntheticEmbeddingModel(8))[1]
+    queries = load_queries(args.query_file)
+    k = max(args.n_results)
+
+    results = {"documents": len(documents), "queries": len(queries), "k": k, "backends": {}}
+    reference_documents = reference_queries = None
+    for backend in ['sentence_transformers'] + [name for name in args.encoder_backends if name != 'sentence_transformers']:
+        try:
+            encoder = reference if backend == 'sentence_transformers' else load_encoder(backend)
+        except ImportError as e:
+            results["backends"][backend] = {"skipped": str(e)}
+            continue
+
+        encoder.encode(documents[:ENCODER_WARMUP]) # Warm up thread pools and allocators
+        start = time.perf_counter()
+        document_vectors = np.asarray(encoder.encode(documents), dtype=np.float32)
+        seconds = time.perf_counter() - start
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            encoder.encode([query])
+            latencies.append(time.perf_counter() - start)
+        query_vectors = np.asarray(encoder.encode(queries), dtype=np.float32)
+
+        entry = {"documents_per_second": len(documents) / seconds, "query_latency": latency_summary(latencies)}
+        if reference_documents is None:
+            reference_documents, reference_queries = document_vectors, query_vectors
+        else:
+            # Recall@k of the backend's ranking against the reference model's
+            expected = top_k(reference_documents, reference_queries, k)
+            found = top_k(document_vectors, query_vectors, k)
+            entry["recall_at_k"] = float(np.mean([len(set(e) & set(f)) / k for e, f in zip(expected, found)]))
+            cosines = np.sum(document_vectors * reference_documents, axis=1) / (
+                np.linalg.norm(document_vectors, axis=1) * np.linalg.norm(reference_documents, axis=1))
+            entry["mean_cosine_to_reference"] = float(cosines.mean())
+        results["backends"][backend] = entry
+
+        for workers in args.encoder_workers:
+            if workers <= 1:
+                continue
+            with ParallelEncoder(backend, workers) as parallel:
+                parallel.encode(documents[:ENCODER_WARMUP * workers])
+                start = time.perf_counter()
+                parallel.encode(documents)
+                entry[f"documents_per_second_{workers}_workers"] = len(documents) / (time.perf_counter() - start)
+    return results
+
+
+def run_metadata(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "git_commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "args": vars(args),
+    }
+
+
+def comma_separated(cast):
+    return lambda value: [cast(item) for item in value.split(',') if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for ingest, retrieval and agent latency.")
+    parser.add_argument("--output_file", type=str, default="benchmark_results.json", help="Where to write the JSON results")
+    parser.add_argument("--suites", type=comma_separated(str), default=["ingest", "retrieval", "agent"],
+                        help="Comma-separated suites to run: ingest, retrieval, agent, encoder")
+    parser.add_argument("--embedding_model", type=str, default="synthetic",
+                        help="'synthetic' for hashed random vectors, or a locally cached SentenceTransformer name")
+    parser.add_argument("--dim", type=int, default=768, help="Dimension of synthetic vectors")
+    parser.add_argument("--data_dir", type=str, default=None,
+                        help="Also time partitioning of the PDFs in this directory (needs unstructured)")
+    parser.add_argument("--pages_per_filing", type=int, default=100, help="Pages per synthetic filing")
+    parser.add_argument("--elements_per_page", type=int, default=12, help="Elements per synthetic page")
+    parser.add_argument("--corpus_sizes", type=comma_separated(int), default=[1000, 10000, 50000],
+                        help="Comma-separated corpus sizes for the retrieval suite")
+    parser.add_argument("--n_results", type=comma_separated(int), default=[3, 10, 30],
+                        help="Comma-separated n_results values for the retrieval suite")
+    parser.add_argument("--index_dtypes", type=comma_separated(str), default=["float32", "float16", "int8"],
+                        help="NumPy index storage types to benchmark")
+    parser.add_argument("--chroma_max_size", type=int, default=10000,
+                        help="Largest corpus also loaded into an in-memory ChromaDB collection (if installed)")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per retrieval measurement")
+    parser.add_argument("--query_file", type=str, default="sample_queries.txt", help="Query texts to sample from")
+    parser.add_argument("--agent_corpus_size", type=int, default=10000, help="Corpus size for the agent suite")
+    parser.add_argument("--llm_latency_ms", type=float, default=0.0, help="Simulated latency of each stub LLM call")
+    parser.add_argument("--encoder_backends", type=comma_separated(str), default=["onnx", "onnx_int8"],
+                        help="Backends compared with the reference model in the encoder suite")
+    parser.add_argument("--encoder_workers", type=comma_separated(int), default=[1, 2],
+                        help="Process counts to time ParallelEncoder with in the encoder suite")
+    parser.add_argument("--encoder_corpus_size", type=int, default=2000, help="Documents encoded in the encoder suite")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.embedding_model == "synthetic":
+        embedding_model = SyntheticEmbeddingModel(args.dim)
+    else:
+        from sentence_transformers import SentenceTransformer
+        embedding_model = SentenceTransformer(args.embedding_model)
+
+    results = {"meta": run_metadata(args)}
+    with tempfile.TemporaryDirectory(prefix="rag_benchmark_") as workdir:
+        if "ingest" in args.suites:
+            results["ingest"] = bench_ingest(args, embedding_model, workdir)
+            print(f"ingest: {results['ingest']['chunks']} chunks, "
+                  f"{results['ingest']['total']['chunks_per_second']:.1f} chunks/s overall")
+            for name, timing in results["ingest"]["chunking"].items():
+                print(f"chunking {name:<15} {timing['seconds'] * 1000:8.1f}ms  x{timing['speedup']:.2f}")
+        if "retrieval" in args.suites:
+            results["retrieval"] = bench_retrieval(args, embedding_model, workdir)
+        if "agent" in args.suites:
+            results["agent"] = bench_agent(args, embedding_model, workdir)
+            for mode in ("sequential", "pipelined"):
+                print(f"agent {mode}: p50 {results['agent'][mode]['summary']['total']['p50_ms']:.2f}ms per query")
+            retry = results["agent"]["bad_synthesis_retry"]
+            print(f"agent rerun after unparseable synthesis calls the model again: {retry['retried']} "
+                  f"({retry['synthesis_calls']} synthesis calls)")
+
+        if "encoder" in args.suites:
+            results["encoder"] = bench_encoder(args)
+            for backend, entry in results["encoder"].get("backends", {}).items():
+                if "documents_per_second" in entry:
+                    print(f"encoder {backend:<22} {entry['documents_per_second']:8.1f} docs/s  "
+                          f"recall@{results['encoder']['k']}={entry.get('recall_at_k', 1.0):.3f}")
+
+    with open(args.output_file, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Benchmark results saved to {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
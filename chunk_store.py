@@ -0,0 +1,367 @@
+import hashlib
+import json
+import mmap
+import os
+import sys
+import threading
+import numpy as np
+from config import CHUNK_STORE_DIR
+
+# Bump when the row or index layout changes; older stores are then rebuilt by the next ingest
+CHUNK_STORE_VERSION = 1
+
+# Metadata fields that repeat across the chunks of a filing. Each distinct
+# (field, value) pair is stored once in the fields file and rows refer to it by number.
+INTERNED_FIELDS = ('source', 'company', 'fiscal_year', 'filename', 'file_directory', 'filetype',
+                   'languages', 'last_modified')
+
+# Open-addressing hash table slot: 64-bit hash of the chunk ID (0 = empty slot)
+# and the offset / length of the chunk's row in the data file
+INDEX_DTYPE = np.dtype([('hash', '<u8'), ('offset', '<u8'), ('length', '<u4')])
+
+
+def id_hash(chunk_id):
+    value = int.from_bytes(hashlib.blake2b(chunk_id.encode('utf-8'), digest_size=8).digest(), 'little')
+    return value or 1 # 0 marks an empty slot
+
+
+def build_index(entries):
+    """Builds the hash table (load factor <= 0.5) for (hash, offset, length) entries."""
+    size = 2
+    while size < 2 * len(entries):
+        size *= 2
+    mask = size - 1
+    slots = [None] * size
+    for entry in entries:
+        slot = entry[0] & mask
+        while slots[slot] is not None:
+            slot = (slot + 1) & mask # Linear probing
+        slots[slot] = entry
+    table = np.zeros(size, dtype=INDEX_DTYPE)
+    used = [slot for slot, entry in enumerate(slots) if entry is not None]
+    if used:
+        table[used] = [slots[slot] for slot in used]
+    return table
+
+
+def store_exists(store_dir):
+    return bool(store_dir) and os.path.exists(os.path.join(store_dir, "meta.json"))
+
+
+def load_meta(store_dir):
+    with open(os.path.join(store_dir, "meta.json"), 'r') as f:
+        meta = json.load(f)
+    if meta.get("version") != CHUNK_STORE_VERSION:
+        raise FileNotFoundError(f"Chunk store in {store_dir} has an unsupported version")
+    return meta
+
+
+def meta_generation(store_dir):
+    # Generation of the current data file, so a rewrite never truncates a file readers may have mapped
+    try:
+        return load_meta(store_dir)["generation"]
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return 0
+
+
+def write_json(path, value):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+
+class ChunkStore:
+    """
+    Read-only view of a chunk store directory.
+
+    Chunks are JSON rows, one per line, in a data file that is memory-mapped
+    together with a hash table from chunk ID to row offset, so get() reads a
+    single row in O(1) without loading the rest of the store. Iteration streams
+    the rows in the order they were written.
+
+    The store is a snapshot: files written by a later commit are not seen until
+    the store is reopened, and files replaced meanwhile stay readable.
+    """
+
+    def __init__(self, store_dir=CHUNK_STORE_DIR):
+        self.dir = store_dir
+        meta = load_meta(store_dir)
+        with open(os.path.join(store_dir, meta["fields_file"]), 'r') as f:
+            self.fields = json.load(f)
+        self.index = np.load(os.path.join(store_dir, meta["index_file"]), mmap_mode='r')
+        self.mask = len(self.index) - 1
+        self.count = meta["count"]
+
+        self.data_path = os.path.join(store_dir, meta["data_file"])
+        with open(self.data_path, 'rb') as f:
+            # mmap can't map an empty file
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, chunk_id):
+        return self.row(chunk_id) is not None
+
+    def row(self, chunk_id):
+        """Returns the raw [id, content, field numbers, metadata] row for `chunk_id`, or None."""
+        target = id_hash(chunk_id)
+        slot = target & self.mask
+        while True:
+            entry_hash, offset, length = self.index[slot].item()
+            if entry_hash == 0:
+                return None
+            if entry_hash == target:
+                row = json.loads(self.data[offset:offset + length])
+                if row[0] == chunk_id: # Guards against 64-bit hash collisions
+                    return row
+            slot = (slot + 1) & self.mask
+
+    def decode(self, row):
+        chunk_id, content, field_numbers, own = row
+        metadata = {}
+        for number in field_numbers:
+            key, value = self.fields[number]
+            metadata[key] = value
+        metadata.update(own)
+        return {"id": chunk_id, "content": content, "metadata": metadata}
+
+    def get(self, chunk_id):
+        """Returns the {"id", "content", "metadata"} chunk with this ID, or None."""
+        row = self.row(chunk_id)
+        return self.decode(row) if row is not None else None
+
+    def content(self, chunk_id):
+        """Returns just the text of a chunk (without decoding its metadata), or None."""
+        row = self.row(chunk_id)
+        return row[1] if row is not None else None
+
+    def __iter__(self):
+        # Rows of deleted or replaced chunks are still in the data file; only indexed ones are live
+        live = set(self.index['offset'][self.index['hash'] != 0].tolist())
+        offset = 0
+        with open(self.data_path, 'rb') as f:
+            for line in f:
+                if offset in live:
+                    yield self.decode(json.loads(line))
+                offset += len(line)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+
+class ChunkStoreWriter:
+    """
+    Adds chunks to a chunk store directory.
+
+    Rows are appended to the data file as chunks are added and become visible to
+    readers only when commit() writes the new index. By default the chunks of
+    earlier commits are kept (a chunk added again under the same ID replaces its
+    old row); with `rewrite=True` the store is rebuilt from the added chunks alone.
+
+    Readers switch to a commit atomically through meta.json, which names the
+    data and index files of the current generation.
+    """
+
+    def __init__(self, store_dir=CHUNK_STORE_DIR, rewrite=False):
+        self.dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        try:
+            meta = None if rewrite else load_meta(store_dir)
+        except (FileNotFoundError, json.JSONDecodeError):
+            meta = None
+
+        if meta is not None:
+            with open(os.path.join(store_dir, meta["fields_file"]), 'r') as f:
+                self.fields = json.load(f)
+            self.generation = meta["generation"]
+            self.commits = meta["commits"]
+            self.data_file = meta["data_file"]
+            index = np.load(os.path.join(store_dir, meta["index_file"]))
+            index = index[index['hash'] != 0]
+            self.committed = dict(zip(index['hash'].tolist(), zip(index['offset'].tolist(), index['length'].tolist())))
+        else:
+            self.fields = []
+            self.generation = meta_generation(store_dir) + 1
+            self.commits = 0
+            self.data_file = f"chunks-{self.generation}.jsonl"
+            self.committed = {}
+        self.field_numbers = {(key, json.dumps(value, sort_keys=True)): number
+                              for number, (key, value) in enumerate(self.fields)}
+
+        # Appending after a crash simply leaves the uncommitted rows unindexed
+        self.file = open(os.path.join(store_dir, self.data_file), 'ab' if meta is not None else 'wb')
+        self.offset = self.file.tell()
+        self.added = {} # hash -> (offset, length) of rows written since the last commit
+
+    def add(self, chunk):
+        field_numbers = []
+        own = {}
+        for key, value in chunk["metadata"].items():
+            if key == 'coordinates':
+                continue # Layout boxes aren't needed downstream (ChromaDB drops them too)
+            if key in INTERNED_FIELDS:
+                token = (key, json.dumps(value, sort_keys=True))
+                number = self.field_numbers.get(token)
+                if number is None:
+                    number = len(self.fields)
+                    self.fields.append([key, value])
+                    self.field_numbers[token] = number
+                field_numbers.append(number)
+            else:
+                own[key] = value
+
+        row = json.dumps([chunk["id"], chunk["content"], field_numbers, own], separators=(',', ':'), ensure_ascii=False)
+        line = row.encode('utf-8') + b"\n"
+        self.file.write(line)
+        self.added[id_hash(chunk["id"])] = (self.offset, len(line) - 1)
+        self.offset += len(line)
+
+    def commit(self, live_ids=None):
+        """
+        Makes the added chunks visible and closes the writer.
+
+        Args:
+            live_ids: If given, only chunks with these IDs are kept in the index;
+                rows of all other chunks become garbage, and the data file is
+                compacted once garbage outweighs the live rows.
+        """
+        self.file.close()
+        entries = dict(self.committed)
+        entries.update(self.added)
+        if live_ids is not None:
+            live_hashes = {id_hash(chunk_id) for chunk_id in live_ids}
+            entries = {entry_hash: entry for entry_hash, entry in entries.items() if entry_hash in live_hashes}
+
+        old_files = set()
+        live_bytes = sum(length + 1 for _, length in entries.values())
+        if os.path.getsize(os.path.join(self.dir, self.data_file)) > 2 * live_bytes:
+            old_files.add(self.data_file)
+            entries = self.compact(entries)
+
+        # Fields only ever grow within a generation, so rows already indexed stay decodable
+        fields_file = f"fields-{self.generation}.json"
+        write_json(os.path.join(self.dir, fields_file), self.fields)
+        self.commits += 1
+        index_file = f"index-{self.generation}-{self.commits}.npy"
+        np.save(os.path.join(self.dir, index_file),
+                build_index([(entry_hash, offset, length) for entry_hash, (offset, length) in entries.items()]))
+
+        previous = load_meta(self.dir) if store_exists(self.dir) else None
+        if previous is not None:
+            old_files.update((previous["index_file"], previous["data_file"], previous["fields_file"]))
+        write_json(os.path.join(self.dir, "meta.json"), {
+            "version": CHUNK_STORE_VERSION, "count": len(entries), "generation": self.generation,
+            "commits": self.commits, "data_file": self.data_file, "index_file": index_file, "fields_file": fields_file,
+        })
+
+        # Readers that still have the old files open keep them until they close them
+        for file_name in old_files - {self.data_file, index_file, fields_file}:
+            try:
+                os.remove(os.path.join(self.dir, file_name))
+            except FileNotFoundError:
+                pass
+
+    def compact(self, entries):
+        # Copies the live rows, in their original order, into the next generation's data file
+        old_path = os.path.join(self.dir, self.data_file)
+        self.generation += 1
+        self.data_file = f"chunks-{self.generation}.jsonl"
+        compacted = {}
+        offset = 0
+        with open(old_path, 'rb') as source, open(os.path.join(self.dir, self.data_file), 'wb') as target:
+            for entry_hash, (old_offset, length) in sorted(entries.items(), key=lambda item: item[1][0]):
+                source.seek(old_offset)
+                target.write(source.read(length + 1))
+                compacted[entry_hash] = (offset, length)
+                offset += length + 1
+        return compacted
+
+
+def store_chunks(chunks, writer):
+    """Passes chunks through unchanged while adding them to a ChunkStoreWriter."""
+    for chunk in chunks:
+        writer.add(chunk)
+        yield chunk
+
+
+class HydratedCollection:
+    """
+    Wraps a ChromaDB collection or NumpyIndex whose documents are kept in the
+    chunk store instead (CHROMA_STORE_DOCUMENTS = False): query() fills in the
+    documents of its results from the store by chunk ID. Everything else is
+    passed through to the wrapped collection.
+
+    The store is reopened whenever a new commit replaces its meta.json, so
+    chunks re-ingested while a long-lived server holds this wrapper are found.
+    Results whose text can't be found even then are dropped with a warning
+    rather than passed on with an empty document.
+    """
+
+    def __init__(self, collection, store_dir=CHUNK_STORE_DIR):
+        self.collection = collection
+        self.store_dir = store_dir
+        self.lock = threading.Lock()
+        self.chunk_store = None
+        self.meta_mtime = None
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def current_store(self, force=False):
+        """Returns the ChunkStore of the latest commit, reopening it if meta.json changed."""
+        meta_mtime = os.stat(os.path.join(self.store_dir, "meta.json")).st_mtime_ns
+        with self.lock:
+            if force or self.chunk_store is None or meta_mtime != self.meta_mtime:
+                # Readers of the previous snapshot in other threads keep their own mappings
+                self.chunk_store = ChunkStore(self.store_dir)
+                self.meta_mtime = meta_mtime
+            return self.chunk_store
+
+    def query(self, *args, include=('documents', 'metadatas', 'distances'), **kwargs):
+        results = self.collection.query(*args, include=include, **kwargs)
+        if 'documents' not in include:
+            return results
+
+        chunk_store = self.current_store()
+        documents = results.get('documents') or [[None] * len(ids) for ids in results['ids']]
+        missing = []
+        for row, (ids, row_documents) in enumerate(zip(results['ids'], documents)):
+            for i, (chunk_id, document) in enumerate(zip(ids, row_documents)):
+                if document is None:
+                    row_documents[i] = chunk_store.content(chunk_id)
+                    if row_documents[i] is None:
+                        missing.append((row, i))
+        if missing:
+            # The collection may be ahead of our snapshot, e.g. a commit within the same mtime tick
+            chunk_store = self.current_store(force=True)
+            for row, i in missing:
+                documents[row][i] = chunk_store.content(results['ids'][row][i])
+        results['documents'] = documents
+
+        # Drop whatever still can't be hydrated instead of sending empty passages to synthesis
+        unhydrated = [chunk_id for ids, row_documents in zip(results['ids'], documents)
+                      for chunk_id, document in zip(ids, row_documents) if document is None]
+        if unhydrated:
+            print(f"Warning: {len(unhydrated)} chunks not found in the chunk store {self.store_dir} "
+                  f"(re-run `python embedding.py`): {unhydrated[:3]}")
+            for row, row_documents in enumerate(documents):
+                keep = [i for i, document in enumerate(row_documents) if document is not None]
+                for key, values in results.items():
+                    if isinstance(values, list) and row < len(values) and isinstance(values[row], list) \
+                            and len(values[row]) == len(row_documents):
+                        values[row] = [values[row][i] for i in keep]
+        return results
+
+
+if __name__ == "__main__":
+    # python chunk_store.py [chunk_id ...]: store statistics, or the chunks with the given IDs
+    chunk_store = ChunkStore(CHUNK_STORE_DIR)
+    if len(sys.argv) > 1:
+        for chunk_id in sys.argv[1:]:
+            print(json.dumps(chunk_store.get(chunk_id), indent=4))
+    else:
+        size = os.path.getsize(chunk_store.data_path)
+        print(f"{len(chunk_store)} chunks, {len(chunk_store.fields)} interned fields, {size / 1e6:.1f} MB of rows in {CHUNK_STORE_DIR}")
@@ -0,0 +1,120 @@
+import hashlib
+from config import CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_UNIT
+from filings import parse_filing_name
+
+
+def chunk_id(file_name, content, occurrence=0):
+    """
+    Builds a stable, content-derived ID for a chunk.
+
+    Re-ingesting an unchanged file reproduces the same IDs, so chunks can be
+    upserted idempotently. `occurrence` disambiguates identical chunk texts
+    within the same filing.
+    """
+    digest = hashlib.sha256(f"{file_name}\0{occurrence}\0{content}".encode('utf-8')).hexdigest()
+    return f"{file_name}:{digest[:32]}"
+
+
+def count_words(text):
+    # Default token count: whitespace-separated words
+    return len(text.split())
+
+
+def tail_words(text, count):
+    """Returns the suffix of `text` starting at its `count`-th last word."""
+    if count <= 0:
+        return ""
+    words = text.rsplit(maxsplit=count)
+    if len(words) <= count:
+        return text
+    # words[0] is the untouched prefix before the last `count` words
+    return text[len(words[0]):].lstrip()
+
+
+def chunk_elements(elements, file_name, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP, unit=CHUNK_UNIT, count_tokens=None):
+    """
+    Groups a stream of partitioned elements from one filing into overlapping chunks.
+
+    Element texts are buffered until the chunk reaches `size`, then emitted with a
+    "This excerpt is from company ... FY ..." header; the last `overlap` characters
+    (or tokens) carry over into the next chunk. Only the metadata of the last
+    element in a chunk is kept, so element.metadata.to_dict() is called once per
+    chunk rather than once per element.
+
+    Args:
+        elements: Iterable of unstructured elements (str() is the text, .metadata.to_dict() the metadata).
+        file_name: Name of the source PDF; gives the company / fiscal year and the chunk IDs.
+        size: Minimum chunk size before it is emitted.
+        overlap: Amount of text repeated at the start of the next chunk.
+        unit: 'chars' or 'tokens' for `size` and `overlap`.
+        count_tokens: Token counter used when unit is 'tokens' (e.g. the embedding
+            model's tokenizer); defaults to counting words. The overlap is always
+            cut at word boundaries.
+
+    Yields:
+        {"id", "content", "metadata"} dictionaries; metadata['chunk_index'] is the
+        chunk's position within the filing.
+    """
+    if unit not in ('chars', 'tokens'):
+        raise ValueError(f"Unknown chunk unit '{unit}'; expected 'chars' or 'tokens'")
+    count_tokens = count_tokens or count_words
+
+    # Extract company and year from filename; the header is the same for every chunk of the filing
+    company, fiscal_year = parse_filing_name(file_name)
+    year = fiscal_year if fiscal_year is not None else 'N/A'
+    header = f"This excerpt is from company {company} FY {year}.\n"
+
+    parts = [] # Buffered element texts, joined only when a chunk is emitted
+    length = 0
+    pending = False # Elements added since the last emitted chunk
+    last_element = None
+    seen = {}
+    index = 0
+
+    def emit(text):
+        nonlocal index
+        # Update metadata with source, page number and normalized filing fields for filtering
+        metadata = last_element.metadata.to_dict()
+        metadata['source'] = file_name
+        metadata['page_number'] = metadata.get('page_number', 'N/A')
+        metadata['company'] = company
+        if fiscal_year is not None:
+            metadata['fiscal_year'] = fiscal_year
+        metadata['chunk_index'] = index
+
+        content = header + text.strip()
+        occurrence = seen.get(content, 0)
+        seen[content] = occurrence + 1
+        index += 1
+        return {"id": chunk_id(file_name, content, occurrence), "content": content, "metadata": metadata}
+
+    def carry_over(text):
+        # Keep the tail of the emitted chunk for the next one, without leading whitespace
+        if unit == 'chars':
+            tail = text[-overlap:].lstrip() if overlap else ""
+            return tail, len(tail)
+        tail = tail_words(text, overlap)
+        return tail, count_tokens(tail)
+
+    for element in elements:
+        element_text = str(element) + "\n" # Add a newline for separation
+        parts.append(element_text)
+        length += len(element_text) if unit == 'chars' else count_tokens(element_text)
+        last_element = element
+        pending = True
+
+        if length >= size:
+            text = "".join(parts)
+            yield emit(text)
+            tail, length = carry_over(text)
+            parts = [tail]
+            pending = False
+
+    # The last element always closes a chunk, and any carried-over text becomes a final chunk
+    if pending:
+        text = "".join(parts)
+        yield emit(text)
+        tail, length = carry_over(text)
+        parts = [tail]
+    if last_element is not None and "".join(parts).strip():
+        yield emit("".join(parts))
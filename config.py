@@ -1,3 +1,98 @@
 DATA_DIR = './data'
 EMBEDDING_MODEL_NAME = 'mukaj/fin-mpnet-base'
 COLLECTION_NAME = 'finance_chroma_db'
+CHROMA_PATH = './chroma_db'
+
+# Parallel ingest: number of processes used to partition PDFs (1 = sequential),
+# the page count above which a filing is split into page ranges, and how many
+# files past the one being yielded are submitted to the pool (bounds the
+# partitioned elements held in memory)
+INGEST_WORKERS = 1
+PAGES_PER_TASK = 25
+PARTITION_LOOKAHEAD_FILES = 4
+
+# Embedding backend (see fast_encoder.py): 'sentence_transformers' (reference),
+# or the model exported to ONNX_MODEL_DIR and run with ONNX Runtime, either in
+# float32 ('onnx') or with dynamically int8-quantized weights ('onnx_int8').
+# Texts are length-sorted into batches of ENCODER_BATCH_SIZE; ingest encodes
+# each batch across ENCODER_WORKERS processes.
+ENCODER_BACKEND = 'sentence_transformers'
+ENCODER_BATCH_SIZE = 32
+ENCODER_WORKERS = 1
+ONNX_MODEL_DIR = './onnx_model'
+
+# Parsed PDF elements are cached here per file content and partition settings,
+# so re-chunking skips partition_pdf (see element_cache.py); None disables it
+ELEMENT_CACHE_DIR = './element_cache'
+
+# Chunking (see chunker.py): minimum chunk size and the overlap carried into the
+# next chunk, both counted in CHUNK_UNIT ('chars' or 'tokens')
+CHUNK_SIZE = 300
+CHUNK_OVERLAP = 100
+CHUNK_UNIT = 'chars'
+
+# Streaming ingest: chunks per embed + upsert batch, and how many batches of
+# chunks may be parsed ahead of the encoder
+EMBEDDING_BATCH_SIZE = 100
+PREFETCH_BATCHES = 2
+
+# Chunk store (see chunk_store.py): the text and metadata of every ingested chunk
+# in a compact row file with an ID index for random access; None disables it.
+# With CHROMA_STORE_DOCUMENTS = False ChromaDB keeps only embeddings and metadata,
+# and query results get their text from the store.
+CHUNK_STORE_DIR = './chunk_store'
+CHROMA_STORE_DOCUMENTS = True
+
+# On-disk embedding cache keyed by (model name, chunk text); None disables it
+EMBEDDING_CACHE_DIR = './embedding_cache'
+EMBEDDING_CACHE_MAX_ENTRIES = 200000
+
+# Query batches: queries processed concurrently by main.py, and the shared
+# Gemini rate limit / retry budget for generate_content calls
+QUERY_CONCURRENCY = 1
+LLM_REQUESTS_PER_MINUTE = 60
+LLM_MAX_RETRIES = 4
+
+# Persistent LLM response cache (SQLite); entries expire after the TTL and the
+# least recently used are evicted beyond the size limit
+LLM_CACHE_PATH = './llm_cache.sqlite'
+LLM_CACHE_TTL_SECONDS = 7 * 24 * 3600
+LLM_CACHE_MAX_ENTRIES = 10000
+
+# Retrieval backend for queries: 'chroma' searches the ChromaDB collection,
+# 'numpy' an in-process memory-mapped export of it (see vector_index.py).
+# The numpy search matrix can be stored as 'float32', 'float16' or 'int8';
+# the top n_results * NUMPY_RESCORE_FACTOR candidates are re-scored in float32.
+# float32 is the fastest; the reduced types only save resident memory (int8
+# a quarter, float16 half) and are upcast per query: int8 costs ~1.3-2x the
+# query time, float16 ~6-13x (numpy converts half floats slowly).
+RETRIEVAL_BACKEND = 'chroma'
+NUMPY_INDEX_DIR = './numpy_index'
+NUMPY_INDEX_DTYPE = 'float32'
+NUMPY_RESCORE_FACTOR = 4
+
+# Warm query server (server.py)
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8765
+
+# Span hooks ('package.module:function') registered by main.py and server.py;
+# each is called with every finished tracing span (see tracing.py)
+TRACE_SPAN_HOOKS = []
+
+# Approximate token budget (~4 characters per token) for the retrieved context
+# sent to the synthesis model, after deduplication and merging (see context.py)
+CONTEXT_TOKEN_BUDGET = 6000
+
+# Pipelined agent queries: retrieve while decomposition streams in and skip
+# decomposition for simple single-company, single-year queries
+PIPELINED_QUERIES = False
+
+# Semantic retrieval cache: a query whose embedding has at least this cosine
+# similarity to a recent query with the same filter reuses its results
+SEMANTIC_CACHE_THRESHOLD = 0.95
+SEMANTIC_CACHE_MAX_ENTRIES = 1024
+
+# Financial fact index (see fact_index.py): figures parsed from the filings'
+# tables at ingest, used to answer single-figure lookups without retrieval or
+# synthesis; None disables it
+FACT_INDEX_PATH = './fact_index.sqlite'
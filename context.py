@@ -0,0 +1,102 @@
+import re
+from config import CONTEXT_TOKEN_BUDGET
+
+# Header prepended to every chunk at ingest (see embedding.chunk_pdf_elements); the
+# "Source:" line of the synthesis context already carries the company and year
+CHUNK_HEADER_PATTERN = re.compile(r"^This excerpt is from company .* FY .*\.\n")
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English prose
+    return (len(text) + 3) // 4
+
+
+def strip_header(content):
+    return CHUNK_HEADER_PATTERN.sub("", content, count=1)
+
+
+def merge_overlap(text, next_text):
+    """Joins two consecutive chunk bodies, dropping the overlap the chunker copied into the second."""
+    for size in range(min(len(text), len(next_text)), 0, -1):
+        if text.endswith(next_text[:size]):
+            return text + next_text[size:]
+    return text + "\n" + next_text
+
+
+def page_order(page):
+    # Numeric pages in numeric order, then anything else ('N/A') after them
+    if isinstance(page, int) or (isinstance(page, str) and page.isdigit()):
+        return 0, int(page), ""
+    return 1, 0, str(page)
+
+
+def page_label(pages):
+    pages = sorted(set(pages), key=page_order)
+    if len(pages) == 1:
+        return pages[0]
+    return f"{pages[0]}-{pages[-1]}"
+
+
+def assemble_context(batch_sources, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Turns the retrieved sources of several sub-queries into the passages sent to synthesis.
+
+    Chunks retrieved by more than one sub-query are kept once, at their best
+    distance. Chunks that are consecutive in the same filing (by the chunk_index
+    recorded at ingest) are merged into one passage without the repeated
+    header and overlap. Passages are then added best-first until the token
+    budget is spent; a passage that doesn't fit is skipped.
+
+    Args:
+        batch_sources: For each sub-query, a list of {"id", "content", "metadata", "distance"}.
+        token_budget: Approximate number of tokens the passages may use in total.
+
+    Returns:
+        A list of {"content", "metadata", "ids", "pages", "distance"} passages, best first.
+    """
+    # Dedupe by chunk ID, keeping the best (lowest) distance
+    unique = {}
+    for sources in batch_sources:
+        for source in sources:
+            key = source.get("id") or source["content"]
+            if key not in unique or source["distance"] < unique[key]["distance"]:
+                unique[key] = source
+
+    # Group runs of consecutive chunks from the same filing
+    runs = []
+    ordered = sorted(
+        unique.values(),
+        key=lambda source: (str(source["metadata"].get("source")), source["metadata"].get("chunk_index", -1))
+    )
+    for source in ordered:
+        metadata = source["metadata"]
+        index = metadata.get("chunk_index")
+        previous = runs[-1][-1]["metadata"] if runs else None
+        if (index is not None and previous is not None and previous.get("source") == metadata.get("source")
+                and previous.get("chunk_index") == index - 1):
+            runs[-1].append(source)
+        else:
+            runs.append([source])
+
+    passages = []
+    for run in runs:
+        content = strip_header(run[0]["content"]).strip()
+        for source in run[1:]:
+            content = merge_overlap(content, strip_header(source["content"]).strip())
+        passages.append({
+            "content": content,
+            "metadata": run[0]["metadata"],
+            "ids": [source.get("id") for source in run],
+            "pages": page_label([source["metadata"].get("page_number", "N/A") for source in run]),
+            "distance": min(source["distance"] for source in run),
+        })
+
+    # Pack the best-ranked passages into the budget
+    packed = []
+    remaining = token_budget
+    for passage in sorted(passages, key=lambda passage: passage["distance"]):
+        tokens = estimate_tokens(passage["content"])
+        if tokens <= remaining:
+            packed.append(passage)
+            remaining -= tokens
+    return packed
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import pickle
+
+# Bump when the stored layout changes; older cache files are then ignored
+ELEMENT_CACHE_VERSION = 1
+
+# partition_pdf arguments used by partitioning.partition_file; part of the cache key
+PARTITION_SETTINGS = {"chunking_strategy": None, "extract_tables_as_elements": True}
+
+
+def file_hash(file_path):
+    """Returns the SHA-256 hex digest of a file's contents."""
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class CachedMetadata:
+    __slots__ = ("shared", "own")
+
+    def __init__(self, shared, own):
+        self.shared = shared
+        self.own = own
+
+    def to_dict(self):
+        # A fresh dict each call, like unstructured's ElementMetadata.to_dict
+        metadata = dict(self.shared)
+        metadata.update(self.own)
+        return metadata
+
+
+class CachedElement:
+    """
+    Element loaded from the ElementCache. Offers what the chunker and fact index
+    use from unstructured elements: str() / .text, .category and .metadata.to_dict().
+    """
+    __slots__ = ("text", "category", "metadata")
+
+    def __init__(self, text, category, metadata):
+        self.text = text
+        self.category = category
+        self.metadata = metadata
+
+    def __str__(self):
+        return self.text
+
+
+class ElementCache:
+    """
+    Persistent cache of partitioned PDF elements, one pickle file per PDF.
+
+    Entries are keyed by the PDF's content hash, its file name (which appears in
+    the element metadata), the partition settings and the unstructured version,
+    so a changed file or setting is simply a miss. Elements are stored as
+    (text, category, metadata) tuples, with the metadata fields that every
+    element of the file shares (filename, filetype, languages, ...) stored once.
+    """
+
+    def __init__(self, cache_dir):
+        self.dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        try:
+            from importlib.metadata import version
+            unstructured_version = version("unstructured")
+        except Exception:
+            unstructured_version = None
+        self.settings = json.dumps([ELEMENT_CACHE_VERSION, PARTITION_SETTINGS, unstructured_version], sort_keys=True)
+
+    def key(self, file_path):
+        payload = f"{file_hash(file_path)}\0{os.path.basename(file_path)}\0{self.settings}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+    def path(self, key):
+        return os.path.join(self.dir, f"{key}.pkl")
+
+    def get(self, key):
+        """Returns the cached elements for `key`, or None on a miss."""
+        try:
+            with open(self.path(key), 'rb') as f:
+                shared, rows = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [CachedElement(text, category, CachedMetadata(shared, own)) for text, category, own in rows]
+
+    def put(self, key, elements):
+        metadatas = [element.metadata.to_dict() for element in elements]
+        # Fields with the same value in every element are stored once per file
+        shared = dict(metadatas[0]) if metadatas else {}
+        for metadata in metadatas[1:]:
+            shared = {name: value for name, value in shared.items() if name in metadata and metadata[name] == value}
+        rows = [
+            (str(element), getattr(element, "category", None),
+             {name: value for name, value in metadata.items() if name not in shared})
+            for element, metadata in zip(elements, metadatas)
+        ]
+
+        os.makedirs(self.dir, exist_ok=True)
+        tmp_path = self.path(key) + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((shared, rows), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path(key)) # Never leave a half-written entry behind
@@ -1,147 +1,309 @@
 import os
-from unstructured.partition.pdf import partition_pdf
-from unstructured.chunking.basic import chunk_elements
-import json
-import re
-from sentence_transformers import SentenceTransformer
-import chromadb
-from config import DATA_DIR, EMBEDDING_MODEL_NAME, COLLECTION_NAME
+import queue
+import threading
+from config import (DATA_DIR, COLLECTION_NAME, CHROMA_PATH,
+                    EMBEDDING_BATCH_SIZE, PREFETCH_BATCHES, CHUNK_STORE_DIR, CHROMA_STORE_DOCUMENTS, FACT_INDEX_PATH,
+                    CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_UNIT, ENCODER_BACKEND, ENCODER_WORKERS, EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_MAX_ENTRIES, RETRIEVAL_BACKEND, NUMPY_INDEX_DIR)
+from embedding_cache import EmbeddingCache, encode_with_cache
+from chunker import chunk_elements
+from element_cache import file_hash
+from chunk_store import ChunkStoreWriter, store_chunks, store_exists
+from fact_index import FactIndex, extract_facts
+from manifest import manifest_path, load_manifest, save_manifest
 
-def create_embeddings(COLLECTION_NAME):
-    data_dir = DATA_DIR
-    pdf_files = os.listdir(data_dir)
-    
-    all_chunks = []
-    overlap_size = 100 # Define overlap size (in characters)
-    
-    for file_name in pdf_files:
-        file_path = os.path.join(data_dir, file_name)
+# Bump when the chunk content or metadata layout changes so existing files are re-ingested
+INGEST_SCHEMA_VERSION = 4
+
+
+def delete_untracked(collection, live_ids, page_size=EMBEDDING_BATCH_SIZE):
+    """Deletes every chunk in the collection whose ID is not in live_ids."""
+    untracked_ids = []
+    total = collection.count()
+    for offset in range(0, total, page_size):
+        page = collection.get(include=[], limit=page_size, offset=offset)
+        untracked_ids.extend(chunk_id for chunk_id in page["ids"] if chunk_id not in live_ids)
+    # Listed before deleting so the pagination offsets stay valid
+    for i in range(0, len(untracked_ids), page_size):
+        collection.delete(ids=untracked_ids[i:i + page_size])
+    if untracked_ids:
+        print(f"Deleted {len(untracked_ids)} chunks not tracked by the ingest manifest from ChromaDB.")
+
+
+def chunk_pdf_elements(elements, file_name, overlap_size=CHUNK_OVERLAP):
+    """
+    Splits the partitioned elements of a single PDF into chunks with a custom header and overlap.
+
+    Returns:
+        A list of {"id", "content", "metadata"} dictionaries. metadata['chunk_index']
+        is the chunk's position within the filing, used to merge neighbouring chunks
+        at query time (see context.py).
+    """
+    return list(chunk_elements(elements, file_name, overlap=overlap_size))
+
+
+def chroma_metadata(metadata):
+    """Processes chunk metadata for ChromaDB: removes 'coordinates' and converts lists to strings."""
+    processed_metadata = {}
+    for key, value in metadata.items():
+        if key == 'coordinates':
+            continue # Skip the coordinates field
+        if isinstance(value, list):
+            processed_metadata[key] = ", ".join(map(str, value)) # Convert list to string
+        else:
+            processed_metadata[key] = value
+    return processed_metadata
+
+
+def batched(iterable, batch_size):
+    """Yields lists of up to `batch_size` items from any iterable."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def prefetch(iterable, size=2):
+    """
+    Consumes `iterable` in a background thread, buffering up to `size` items.
+
+    Lets PDF partitioning/chunking run ahead while the caller is busy encoding.
+    Exceptions raised by the iterable are re-raised in the consumer.
+    """
+    buffer = queue.Queue(maxsize=size)
+    done = object()
+
+    def produce():
         try:
-            elements = partition_pdf(
-                filename=file_path,
-                # Keeping basic chunking strategy for initial element extraction,
-                # we will handle overlapping and custom headers manually.
-                chunking_strategy=None, # Disable automatic chunking here
-                extract_tables_as_elements=True # Extract tables as separate elements
-            )
-    
-            # Extract company and year from filename
-            match = re.match(r'([a-zA-Z]+)-10-k-(\d{4})\.pdf', file_name)
-            company = match.group(1).upper() if match else file_name
-            year = match.group(2) if match else 'N/A'
-    
-            # Process elements to create chunks with metadata, custom header, and overlap
-            current_chunk_text = ""
-            current_metadata = {}
-            for i, element in enumerate(elements):
-                element_text = str(element)
-                element_metadata = element.metadata.to_dict()
-    
-                # Update metadata with source and page number
-                element_metadata['source'] = file_name
-                element_metadata['page_number'] = element_metadata.get('page_number', 'N/A')
-    
-                # Create the custom header
-                header = f"This excerpt is from company {company} FY {year}.\n"
-    
-                # Add element to the current chunk text
-                current_chunk_text += element_text + "\n" # Add a newline for separation
-    
-                # Update metadata (simple approach: use metadata from the last element in the chunk)
-                current_metadata = element_metadata
-    
-                # If current chunk is large enough or it's the last element, create a chunk
-                if len(current_chunk_text) >= 300 or i == len(elements) - 1:
-                    # Add the header to the beginning of the chunk content
-                    chunk_content = header + current_chunk_text.strip()
-    
-                    chunk = {
-                        "content": chunk_content,
-                        "metadata": current_metadata
-                    }
-                    all_chunks.append(chunk)
-    
-                    # Prepare for the next chunk with overlap
-                    # Keep the last 'overlap_size' characters for the next chunk
-                    current_chunk_text = current_chunk_text[-overlap_size:].lstrip() # Use lstrip to avoid leading whitespace from overlap
-    
-    
-            # Handle remaining text if any
-            if current_chunk_text.strip():
-                 header = f"This excerpt is from company {company} FY {year}.\n"
-                 chunk_content = header + current_chunk_text.strip()
-                 chunk = {
-                    "content": chunk_content,
-                    "metadata": current_metadata # Use metadata of the last processed element
-                 }
-                 all_chunks.append(chunk)
-    
-    
+            for item in iterable:
+                buffer.put((item, None))
+        except Exception as e:
+            buffer.put((None, e))
+        buffer.put((done, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item, error = buffer.get()
+        if error is not None:
+            raise error
+        if item is done:
+            return
+        yield item
+
+
+def iter_file_chunks(data_dir, pending_files, fact_index=None):
+    """
+    Partitions and chunks the pending files one at a time.
+
+    Args:
+        data_dir: Directory holding the PDFs.
+        pending_files: List of (file_name, file_hash) tuples to ingest.
+        fact_index: Optional FactIndex; the facts in each file's tables replace its previous ones.
+
+    Yields:
+        (file_name, file_hash, chunks) for every file that was processed successfully.
+    """
+    from partitioning import partition_files # Imported lazily: pulls in the unstructured PDF stack
+
+    # Partition the pending files (in parallel when INGEST_WORKERS > 1)
+    file_paths = [os.path.join(data_dir, file_name) for file_name, _ in pending_files]
+    for (file_name, current_hash), (_, elements, error) in zip(pending_files, partition_files(file_paths)):
+        if error is not None:
+            print(f"Error processing {file_name}: {error}")
+            continue
+        try:
+            chunks = chunk_pdf_elements(elements, file_name)
         except Exception as e:
             print(f"Error processing {file_name}: {e}")
-    
-    print(f"Created {len(all_chunks)} chunks.")
-    
-    with open("chunks_with_metadata.json", "w") as f:
-        json.dump(all_chunks, f, indent=4)
-    
-    print("Chunks saved to chunks_with_metadata.json")
-    
-    # Initialize the embedding model
-    embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
-    
-    # Initialize ChromaDB client 
-    client = chromadb.PersistentClient(path="./chroma_db")
-    
+            continue
+        if fact_index is not None:
+            try:
+                fact_index.replace_file(file_name, extract_facts(elements, file_name))
+            except Exception as e:
+                print(f"Error extracting table facts from {file_name}: {e}")
+        yield file_name, current_hash, chunks
+
+
+def create_embeddings(COLLECTION_NAME):
+    """
+    Incrementally ingests the PDFs in DATA_DIR into the ChromaDB collection.
+
+    A manifest records a content hash per source file and the IDs of the chunks
+    it produced, so only new or changed files are parsed, embedded and upserted,
+    and the chunks of removed files are deleted.
+
+    Chunks stream from the partitioner through fixed-size embed + upsert batches,
+    so memory stays bounded by a batch (plus the filing being chunked) and
+    parsing of the next file overlaps with encoding of the current batch. They
+    are also added to the chunk store (CHUNK_STORE_DIR), which holds their text
+    instead of ChromaDB when CHROMA_STORE_DOCUMENTS is False. The figures in
+    each filing's tables go to the fact index (FACT_INDEX_PATH).
+    """
+    import chromadb
+    from fast_encoder import load_encoder, encoder_name, ParallelEncoder
+
+    if not CHROMA_STORE_DOCUMENTS and not CHUNK_STORE_DIR:
+        raise ValueError("CHROMA_STORE_DOCUMENTS = False needs a CHUNK_STORE_DIR to keep the chunk texts in")
+
+    data_dir = DATA_DIR
+    pdf_files = sorted(os.listdir(data_dir))
+
+    # Initialize ChromaDB client
+    client = chromadb.PersistentClient(path=CHROMA_PATH)
+
     # Create or get a collection
     collection_name = COLLECTION_NAME
+    chunk_settings = {"size": CHUNK_SIZE, "overlap": CHUNK_OVERLAP, "unit": CHUNK_UNIT}
     try:
         collection = client.create_collection(name=collection_name)
+        manifest = {"files": {}, "schema_version": INGEST_SCHEMA_VERSION, "chunking": chunk_settings,
+                    "encoder": ENCODER_BACKEND, "chunk_store": CHUNK_STORE_DIR,
+                    "chroma_documents": CHROMA_STORE_DOCUMENTS,
+                    "fact_index": FACT_INDEX_PATH} # Fresh collection, nothing has been ingested into it yet
     except:
         collection = client.get_collection(name=collection_name)
-    
-    
-    # Prepare data for ChromaDB
-    ids = []
-    documents = []
-    metadatas = []
-    
-    for i, chunk in enumerate(all_chunks):
-        ids.append(f"chunk_{i}")
-        documents.append(chunk["content"])
-        
-        # Process metadata: remove 'coordinates' and convert lists to strings
-        processed_metadata = {}
-        for key, value in chunk["metadata"].items():
-            if key == 'coordinates':
-                continue # Skip the coordinates field
-            if isinstance(value, list):
-                processed_metadata[key] = ", ".join(map(str, value)) # Convert list to string
-            else:
-                processed_metadata[key] = value
-        metadatas.append(processed_metadata)
-    
-    
-    # Add data to ChromaDB in batches to avoid exceeding payload limits
-    batch_size = 100  # Adjust batch size as needed
-    for i in range(0, len(ids), batch_size):
-        batch_ids = ids[i:i+batch_size]
-        batch_documents = documents[i:i+batch_size]
-        batch_metadatas = metadatas[i:i+batch_size]
-    
-        # Generate embeddings for the current batch
-        batch_embeddings = embedding_model.encode(batch_documents).tolist()
-    
-        # Add batch to ChromaDB
-        collection.add(
+        manifest = load_manifest(collection_name)
+    # A collection without a manifest was built before ingest was tracked (e.g. with
+    # positional chunk_0..chunk_N IDs); whatever the new manifest doesn't list is removed
+    untracked = not os.path.exists(manifest_path(collection_name)) and collection.count() > 0
+
+    indexed_files = manifest["files"]
+    # Files ingested under an older chunk layout, other chunk settings, another
+    # encoder backend or without the current chunk store / fact index are re-ingested even if unchanged
+    schema_current = (manifest.get("schema_version") == INGEST_SCHEMA_VERSION
+                      and manifest.get("chunking", chunk_settings) == chunk_settings
+                      and manifest.get("encoder", "sentence_transformers") == ENCODER_BACKEND
+                      and manifest.get("chunk_store") == CHUNK_STORE_DIR
+                      and manifest.get("chroma_documents", True) == CHROMA_STORE_DOCUMENTS
+                      and (not CHUNK_STORE_DIR or store_exists(CHUNK_STORE_DIR))
+                      and manifest.get("fact_index") == FACT_INDEX_PATH
+                      and (not FACT_INDEX_PATH or os.path.exists(FACT_INDEX_PATH)))
+
+    # Work out which files are new or changed before partitioning anything
+    pending_files = []
+    for file_name in pdf_files:
+        try:
+            current_hash = file_hash(os.path.join(data_dir, file_name))
+        except Exception as e:
+            print(f"Error processing {file_name}: {e}")
+            continue
+        previous = indexed_files.get(file_name)
+        if previous and previous["hash"] == current_hash and schema_current:
+            continue # Unchanged since the last ingest
+        pending_files.append((file_name, current_hash))
+
+    # Files that were ingested before but are no longer in DATA_DIR
+    removed_files = [file_name for file_name in indexed_files if file_name not in pdf_files]
+
+    if not pending_files and not removed_files and not untracked:
+        print("Collection is up to date; nothing to ingest.")
+        return
+
+    stale_ids = []
+    for file_name in removed_files:
+        stale_ids.extend(indexed_files[file_name]["chunk_ids"])
+
+    updated_files = {}
+
+    fact_index = FactIndex(FACT_INDEX_PATH) if FACT_INDEX_PATH else None
+
+    def iter_chunks():
+        # Flatten per-file chunk lists, recording manifest updates as each file completes
+        for file_name, current_hash, chunks in iter_file_chunks(data_dir, pending_files, fact_index):
+            previous = indexed_files.get(file_name)
+            new_ids = [chunk["id"] for chunk in chunks]
+            if previous:
+                # Chunks of the old version that the new version no longer produces
+                stale_ids.extend(set(previous["chunk_ids"]) - set(new_ids))
+            updated_files[file_name] = {"hash": current_hash, "chunk_ids": new_ids}
+            yield from chunks
+
+    chunks = prefetch(iter_chunks(), size=PREFETCH_BATCHES * EMBEDDING_BATCH_SIZE)
+    store_writer = ChunkStoreWriter(CHUNK_STORE_DIR) if CHUNK_STORE_DIR else None
+    if store_writer is not None:
+        chunks = store_chunks(chunks, store_writer)
+
+    models = []
+
+    def load_embedding_model():
+        # Initialize the embedding model only when a chunk misses the cache
+        if not models:
+            models.append(ParallelEncoder(ENCODER_BACKEND, ENCODER_WORKERS) if ENCODER_WORKERS > 1 else load_encoder(ENCODER_BACKEND))
+        return models[0]
+
+    cache = None
+    if EMBEDDING_CACHE_DIR:
+        # Backends produce slightly different vectors, so each gets its own cache
+        cache = EmbeddingCache(EMBEDDING_CACHE_DIR, encoder_name(ENCODER_BACKEND), EMBEDDING_CACHE_MAX_ENTRIES)
+
+    upserted = 0
+
+    # Upsert data to ChromaDB in batches to avoid exceeding payload limits
+    for batch_number, batch in enumerate(batched(chunks, EMBEDDING_BATCH_SIZE), start=1):
+        batch_ids = [chunk["id"] for chunk in batch]
+        batch_documents = [chunk["content"] for chunk in batch]
+        batch_metadatas = [chroma_metadata(chunk["metadata"]) for chunk in batch]
+
+        # Generate embeddings for the current batch, reusing cached vectors for unchanged text
+        batch_embeddings = encode_with_cache(batch_documents, load_embedding_model, cache).tolist()
+
+        # Upsert so re-ingesting a chunk with an existing ID replaces it instead of failing
+        collection.upsert(
             embeddings=batch_embeddings,
-            documents=batch_documents,
+            documents=batch_documents if CHROMA_STORE_DOCUMENTS else None, # Otherwise only in the chunk store
             metadatas=batch_metadatas,
             ids=batch_ids
         )
-        print(f"Added batch {i//batch_size + 1} to ChromaDB")
-    
-    print(f"Successfully added {len(ids)} chunks to ChromaDB.")
+        upserted += len(batch_ids)
+        print(f"Upserted batch {batch_number} to ChromaDB")
+
+    if models and isinstance(models[0], ParallelEncoder):
+        models[0].close()
+
+    print(f"Created {upserted} chunks from {len(updated_files)} new or changed files.")
+    if cache is not None:
+        cache.flush()
+        print(f"Embedding cache: {cache.hits} hits, {cache.misses} misses.")
+
+    # Remove chunks from changed or deleted files
+    for i in range(0, len(stale_ids), EMBEDDING_BATCH_SIZE):
+        collection.delete(ids=stale_ids[i:i+EMBEDDING_BATCH_SIZE])
+    if stale_ids:
+        print(f"Deleted {len(stale_ids)} stale chunks from ChromaDB.")
+
+    # Only record files once all of their chunks are in the collection; since IDs
+    # are content-derived, re-running after a crash simply re-upserts them
+    for file_name in removed_files:
+        del indexed_files[file_name]
+        if fact_index is not None:
+            fact_index.delete_file(file_name)
+    indexed_files.update(updated_files)
+    if untracked:
+        live_ids = {chunk_id for entry in indexed_files.values() for chunk_id in entry["chunk_ids"]}
+        delete_untracked(collection, live_ids)
+    if store_writer is not None:
+        # The store keeps exactly the chunks the collection now holds
+        store_writer.commit(live_ids=[chunk_id for entry in indexed_files.values() for chunk_id in entry["chunk_ids"]])
+        print(f"Chunk store in {CHUNK_STORE_DIR} updated.")
+    manifest["schema_version"] = INGEST_SCHEMA_VERSION
+    manifest["chunking"] = chunk_settings
+    manifest["encoder"] = ENCODER_BACKEND
+    manifest["chunk_store"] = CHUNK_STORE_DIR
+    manifest["chroma_documents"] = CHROMA_STORE_DOCUMENTS
+    manifest["fact_index"] = FACT_INDEX_PATH
+    # Bumped on every ingest that changed the collection; query-side caches key on it
+    manifest["generation"] = manifest.get("generation", 0) + 1
+    save_manifest(collection_name, manifest)
+
+    print(f"Successfully upserted {upserted} chunks to ChromaDB.")
+
+    if RETRIEVAL_BACKEND == 'numpy':
+        # Keep the in-process index in sync with the collection it was exported from
+        from vector_index import export_chroma_collection
+        export_chroma_collection(collection, NUMPY_INDEX_DIR)
 
 if __name__=="__main__":
     create_embeddings(COLLECTION_NAME)
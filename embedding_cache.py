@@ -0,0 +1,182 @@
+import hashlib
+import heapq
+import json
+import os
+import numpy as np
+
+
+# Fraction of max_entries evicted beyond what a full cache needs, so the index
+# rewrite that must precede reusing evicted rows happens once per many batches
+EVICTION_HEADROOM = 0.05
+
+
+class EmbeddingCache:
+    """
+    Persistent cache of embedding vectors keyed by hash(model name, text).
+
+    Vectors are stored in a float32 memory-mapped file (vectors.f32) that grows
+    on demand up to `max_entries` rows; index.json maps each key to its row and
+    a last-used counter. Once full, the least recently used entries are evicted,
+    along with EVICTION_HEADROOM of the capacity to make room for later batches.
+    Each model gets its own subdirectory since vector sizes differ between models.
+
+    A row that index.json on disk still maps to an evicted key is not overwritten
+    until flush() has written an index without that key, so a crash at any point
+    leaves every indexed key pointing at its own vector.
+    """
+
+    def __init__(self, cache_dir, model_name, max_entries):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.dir = os.path.join(cache_dir, hashlib.sha256(model_name.encode('utf-8')).hexdigest()[:16])
+        self.vectors_path = os.path.join(self.dir, "vectors.f32")
+        self.index_path = os.path.join(self.dir, "index.json")
+
+        self.dim = None
+        self.capacity = 0 # Rows currently allocated in vectors.f32
+        self.tick = 0 # Logical clock for LRU ordering
+        self.entries = {} # key -> [row, last_used]
+        self.free_rows = [] # Rows no key in index.json on disk refers to; safe to overwrite
+        self.released_rows = [] # Rows of evicted keys that index.json on disk still refers to
+        self.persisted_rows = set() # Rows referenced by index.json on disk
+        self.vectors = None
+        self.hits = 0
+        self.misses = 0
+
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+            if index["model_name"] == model_name and os.path.exists(self.vectors_path):
+                self.dim = index["dim"]
+                self.capacity = index["capacity"]
+                self.tick = index["tick"]
+                self.entries = index["entries"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            pass # Missing or unreadable index: start with an empty cache
+
+        if self.dim is not None:
+            self.persisted_rows = {row for row, _ in self.entries.values()}
+            self.free_rows = [row for row in range(self.capacity) if row not in self.persisted_rows]
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r+', shape=(self.capacity, self.dim))
+            # Honour a lowered max_entries from config
+            self._evict(len(self.entries) - self.max_entries)
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode('utf-8')).hexdigest()[:32]
+
+    def get_many(self, texts):
+        """Returns a list with the cached vector for each text, or None where it is not cached."""
+        found = []
+        for text in texts:
+            entry = self.entries.get(self.key(text))
+            if entry is None:
+                self.misses += 1
+                found.append(None)
+                continue
+            self.hits += 1
+            self.tick += 1
+            entry[1] = self.tick
+            found.append(np.array(self.vectors[entry[0]]))
+        return found
+
+    def put_many(self, texts, vectors):
+        """Stores vectors for the given texts, evicting least recently used entries if needed."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        keys = [self.key(text) for text in texts]
+        new_keys = set([key for key in dict.fromkeys(keys) if key not in self.entries][:self.max_entries])
+        overflow = len(self.entries) + len(new_keys) - self.max_entries
+        if overflow > 0:
+            self._evict(overflow + int(self.max_entries * EVICTION_HEADROOM))
+        self._reserve(len(new_keys))
+        if len(self.free_rows) < len(new_keys):
+            # Only rows of evicted keys are left: write an index without those keys before
+            # overwriting their vectors, so a crash in between can't map them to new vectors
+            self.flush()
+
+        for key, vector in zip(keys, vectors):
+            self.tick += 1
+            entry = self.entries.get(key)
+            if entry is None:
+                if key not in new_keys:
+                    continue # Batch is larger than the whole cache
+                entry = self.entries[key] = [self.free_rows.pop(), self.tick]
+            entry[1] = self.tick
+            self.vectors[entry[0]] = vector
+
+    def flush(self):
+        """Writes the vectors and the index to disk."""
+        if self.vectors is None:
+            return
+        self.vectors.flush()
+        index = {
+            "model_name": self.model_name,
+            "dim": self.dim,
+            "capacity": self.capacity,
+            "tick": self.tick,
+            "entries": self.entries,
+        }
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+        # The rows of keys evicted before this index was written are now unreferenced
+        self.persisted_rows = {row for row, _ in self.entries.values()}
+        self.free_rows.extend(self.released_rows)
+        self.released_rows = []
+
+    def _evict(self, count):
+        if count <= 0:
+            return
+        oldest = heapq.nsmallest(count, self.entries.items(), key=lambda item: item[1][1])
+        for key, (row, _) in oldest:
+            del self.entries[key]
+            if row in self.persisted_rows:
+                self.released_rows.append(row)
+            else:
+                self.free_rows.append(row)
+
+    def _reserve(self, count):
+        # Grow vectors.f32 (doubling, capped at max_entries) until `count` rows are free
+        if len(self.free_rows) >= count:
+            return
+        new_capacity = max(self.capacity, 1024)
+        while new_capacity - self.capacity + len(self.free_rows) < count:
+            new_capacity *= 2
+        new_capacity = max(min(new_capacity, self.max_entries), self.capacity) # Never truncate rows in use
+
+        os.makedirs(self.dir, exist_ok=True)
+        if self.vectors is not None:
+            self.vectors.flush()
+            self.vectors = None
+        with open(self.vectors_path, 'ab') as f:
+            f.truncate(new_capacity * self.dim * 4)
+        self.free_rows.extend(range(self.capacity, new_capacity))
+        self.capacity = new_capacity
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r+', shape=(self.capacity, self.dim))
+
+
+def encode_with_cache(texts, load_model, cache=None):
+    """
+    Encodes texts, serving vectors from `cache` where possible.
+
+    Args:
+        texts: The texts to encode.
+        load_model: Callable returning the embedding model; only called on a cache miss.
+        cache: An EmbeddingCache, or None to always encode.
+
+    Returns:
+        A float32 array with one row per text.
+    """
+    if cache is None:
+        return np.asarray(load_model().encode(texts), dtype=np.float32)
+
+    cached = cache.get_many(texts)
+    missing = [i for i, vector in enumerate(cached) if vector is None]
+    if missing:
+        encoded = np.asarray(load_model().encode([texts[i] for i in missing]), dtype=np.float32)
+        cache.put_many([texts[i] for i in missing], encoded)
+        for i, vector in zip(missing, encoded):
+            cached[i] = vector
+    return np.stack(cached)
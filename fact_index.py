@@ -0,0 +1,295 @@
+import re
+import sqlite3
+import sys
+import threading
+from collections import deque
+from html.parser import HTMLParser
+from config import FACT_INDEX_PATH
+from filings import parse_filing_name, mentioned_companies, COMPANY_ALIASES, YEAR_PATTERN, COMPARISON_PATTERN
+
+# Financial fact index: the figures reported in the filings' tables, one row per
+# (line item, period) cell, so lookups like "NVIDIA total revenue FY2024" can be
+# answered with a page citation without vector search or an LLM call.
+
+# Scale stated in a table's caption, e.g. "(In millions, except per share data)"
+UNIT_PATTERN = re.compile(r'\bin (thousands|millions|billions)\b', re.IGNORECASE)
+
+# Rows the caption's scale doesn't apply to: per-share amounts and share counts.
+# Matched against the row label and the heading row above it (e.g. "Net income per share:")
+SHARE_ITEM_PATTERN = re.compile(r'\bper share\b|\bshares\b', re.IGNORECASE)
+
+# A column header naming a period carries its year, e.g. "Jan 28, 2024" or "Year Ended June 30, 2023"
+PERIOD_YEAR_PATTERN = re.compile(r'\b((?:19|20)\d{2})\b')
+
+# Column headers of derived figures, e.g. "$ Change", "% Change" or "2024 vs 2023"; never a period
+CHANGE_HEADER_PATTERN = re.compile(r'\b(change|vs|versus|variance)\b|%', re.IGNORECASE)
+
+# Wording that asks for explanation or a derived figure rather than one reported value
+NON_LOOKUP_PATTERN = re.compile(
+    r'\b(why|how(?! much| many)|explain\w*|describ\w*|discuss\w*|summar\w*|risks?|strateg\w*|impact\w*|factors?|'
+    r'drivers?|outlook|guidance|growth|grow|grew|change[sd]?|increase[sd]?|decrease[sd]?|trends?)\b'
+)
+
+# Row labels too generic to identify a figure on their own
+GENERIC_ITEMS = {'total', 'net', 'other', 'less', 'subtotal'}
+
+# Words that don't change which figure a lookup asks for. Everything else in the
+# query, once the company and year are removed, must be exactly the line item.
+FILLER_WORDS = {
+    'what', 'was', 'were', 'is', 'are', 'the', 'a', 'an', 'of', 'in', 'for', 'during', 'did', 'does', 'do',
+    'how', 'much', 'many', 'fiscal', 'year', 'fy', 'reported', 'report', 'total', 'its', 'their', 'amount',
+    'inc', 'corp', 'corporation', 'company',
+}
+
+
+def item_key(text):
+    """Normalizes a line item or query for matching: lower case, words only, no footnote markers."""
+    text = re.sub(r"'s\b", "", text.lower())
+    text = re.sub(r'\(\d\)', ' ', text)
+    return " ".join(re.findall(r'[a-z0-9]+', text))
+
+
+def lookup_words(text, aliases=()):
+    """The words of a query or line item that identify a figure: no filler, company aliases or years."""
+    return [word for word in item_key(text).split()
+            if word not in FILLER_WORDS and word not in aliases and not re.fullmatch(r'(fy)?\d{2}|(fy)?\d{4}', word)]
+
+
+def parse_number(text):
+    """Parses a table cell like "$ 60,922", "(1,234)" or "12.5 %" to a float, or returns None."""
+    cleaned = text.replace('$', '').replace(',', '').replace(' ', '')
+    negative = cleaned.startswith('(') or cleaned.startswith('-')
+    cleaned = cleaned.strip('()-%')
+    if not re.fullmatch(r'\d+(\.\d+)?', cleaned):
+        return None
+    value = float(cleaned)
+    return -value if negative else value
+
+
+class TableParser(HTMLParser):
+    """Collects the rows of an HTML table as lists of cell texts; cells spanning columns are repeated."""
+
+    def __init__(self):
+        super().__init__()
+        self.rows = []
+        self.cell = None
+        self.colspan = 1
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tr':
+            self.rows.append([])
+        elif tag in ('td', 'th'):
+            if not self.rows:
+                self.rows.append([])
+            self.cell = []
+            try:
+                self.colspan = max(1, int(dict(attrs).get('colspan') or 1))
+            except ValueError:
+                self.colspan = 1
+
+    def handle_endtag(self, tag):
+        if tag in ('td', 'th') and self.cell is not None:
+            text = " ".join("".join(self.cell).split())
+            self.rows[-1].extend([text] * self.colspan)
+            self.cell = None
+
+    def handle_data(self, data):
+        if self.cell is not None:
+            self.cell.append(data)
+
+
+def parse_table(table_html):
+    parser = TableParser()
+    parser.feed(table_html)
+    parser.close()
+    return [row for row in parser.rows if any(row)]
+
+
+def table_facts(rows):
+    """
+    Turns table rows into (line item, period, value, value text, section) tuples.
+
+    Header rows (everything before the first row with a label and a non-year
+    number) name the periods; each later row's numbers are assigned to the
+    period of their column, or in order when the row has one number per period.
+    Numbers under other headers (e.g. "$ Change" or "% Change") are ignored.
+    A body row with a label but no numbers (e.g. "Net income per share:") is the
+    section of the rows below it, like "Basic" and "Diluted".
+    """
+    headers = {}
+    facts = []
+    in_body = False
+    section = ""
+    for row in rows:
+        label = row[0] if row else ""
+        numbers = [(column, parse_number(text), text) for column, text in enumerate(row) if column > 0]
+        numbers = [(column, value, text) for column, value, text in numbers if value is not None]
+        if not in_body:
+            if label and parse_number(label) is None and any(not re.fullmatch(r'(19|20)\d{2}', text) for _, _, text in numbers):
+                in_body = True
+            else:
+                for column, text in enumerate(row):
+                    if column > 0 and text:
+                        headers[column] = f"{headers[column]} {text}" if column in headers else text
+                continue
+
+        line_item = re.sub(r'\s*\(\d\)\s*$', '', label).rstrip(':').strip()
+        if line_item and not numbers:
+            section = line_item
+        if not numbers or not line_item or item_key(line_item) in GENERIC_ITEMS:
+            continue
+
+        periods = {column: header for column, header in headers.items()
+                   if PERIOD_YEAR_PATTERN.search(header) and not CHANGE_HEADER_PATTERN.search(header)}
+        ordered = []
+        for column in sorted(periods):
+            if not ordered or ordered[-1] != periods[column]: # Spanned header cells repeat
+                ordered.append(periods[column])
+        in_periods = [(periods[column], value, text) for column, value, text in numbers if column in periods]
+        if in_periods and len({period for period, _, _ in in_periods}) == len(in_periods):
+            assigned = in_periods
+        elif len(numbers) == len(ordered):
+            assigned = [(period, value, text) for period, (_, value, text) in zip(ordered, numbers)]
+        else:
+            continue # Can't tell which period each number belongs to
+        for period, value, text in assigned:
+            facts.append((line_item, period, value, text, section))
+    return facts
+
+
+def extract_facts(elements, file_name):
+    """
+    Parses the table elements of one filing into facts.
+
+    Returns:
+        A list of dictionaries with source, company, fiscal_year, line_item, period,
+        period_year, value, value_text, unit and page.
+    """
+    company, fiscal_year = parse_filing_name(file_name)
+    recent_text = deque(maxlen=3) # Captions stating the unit precede the table
+    facts = []
+    for element in elements:
+        # Only tables need their metadata; to_dict() on every element would cost as much as the chunker saves
+        metadata = element.metadata.to_dict() if getattr(element, 'category', None) == 'Table' else {}
+        table_html = metadata.get('text_as_html')
+        if not table_html:
+            recent_text.append(str(element))
+            continue
+
+        unit = UNIT_PATTERN.search(" ".join(recent_text) + " " + str(element))
+        for line_item, period, value, text, section in table_facts(parse_table(table_html)):
+            # Per-share amounts aren't "in millions" even when the caption says so; without a unit lookup() misses
+            row_unit = None if not unit or SHARE_ITEM_PATTERN.search(f"{section} {line_item}") else unit.group(1).lower()
+            facts.append({
+                "source": file_name, "company": company, "fiscal_year": fiscal_year,
+                "line_item": line_item, "period": period,
+                "period_year": int(PERIOD_YEAR_PATTERN.findall(period)[-1]),
+                "value": value, "value_text": re.sub(r'\$\s+', '$', text), "unit": row_unit,
+                "page": metadata.get('page_number'),
+            })
+    return facts
+
+
+class FactIndex:
+    """
+    SQLite store of the facts extracted from the filings' tables, indexed by
+    company and period year. Safe to share between threads.
+    """
+
+    COLUMNS = ("source", "company", "fiscal_year", "line_item", "item_key", "period", "period_year",
+               "value", "value_text", "unit", "page")
+
+    def __init__(self, path=FACT_INDEX_PATH):
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS facts ("
+                "source TEXT, company TEXT, fiscal_year INTEGER, line_item TEXT, item_key TEXT, period TEXT, "
+                "period_year INTEGER, value REAL, value_text TEXT, unit TEXT, page INTEGER)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS facts_lookup ON facts (company, period_year)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS facts_source ON facts (source)")
+
+    def replace_file(self, file_name, facts):
+        """Replaces the facts of one filing (e.g. after it changed)."""
+        rows = [tuple(item_key(fact["line_item"]) if column == "item_key" else fact[column] for column in self.COLUMNS)
+                for fact in facts]
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM facts WHERE source = ?", (file_name,))
+            self.conn.executemany(f"INSERT INTO facts VALUES ({', '.join('?' * len(self.COLUMNS))})", rows)
+
+    def delete_file(self, file_name):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM facts WHERE source = ?", (file_name,))
+
+    def lookup(self, query_text):
+        """
+        Answers a query asking for a single reported figure of one company and year.
+
+        The query must name exactly one company and one year, with no comparison or
+        explanation wording, and its remaining words (ignoring FILLER_WORDS) must be
+        exactly a line item of that company's tables, so a qualifier like "cloud",
+        "per employee" or "Q3" leaves the query to retrieval. The facts for that
+        item and year must agree on a single value (the filing for that fiscal year
+        is preferred over later ones restating it) and state their unit.
+
+        Returns:
+            {"answer", "fact", "source"} where source has the same shape as the
+            agent's structured sources, or None if the query isn't such a lookup.
+        """
+        lowered = query_text.lower()
+        companies = mentioned_companies(query_text)
+        years = set(YEAR_PATTERN.findall(query_text))
+        if len(companies) != 1 or len(years) != 1 or COMPARISON_PATTERN.search(lowered) or NON_LOOKUP_PATTERN.search(lowered):
+            return self.miss()
+        company, year = companies[0], int(years.pop())
+
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM facts WHERE company = ? AND period_year = ?", (company, year)
+            ).fetchall()
+        facts = [dict(zip(self.COLUMNS, row)) for row in rows]
+
+        # Every word left in the query must belong to the line item, and vice versa
+        query_words = lookup_words(query_text, COMPANY_ALIASES[company])
+        if not query_words:
+            return self.miss()
+        candidates = [fact for fact in facts if lookup_words(fact["line_item"]) == query_words]
+        candidates = [fact for fact in candidates if fact["fiscal_year"] == year] or candidates
+        if not candidates or len({fact["value"] for fact in candidates}) != 1:
+            return self.miss() # Unknown item, or the same label in a segment table; leave it to retrieval
+        fact = min(candidates, key=lambda fact: (fact["page"] is None, fact["page"] or 0))
+        if not fact["unit"]:
+            return self.miss() # A figure without its scale (thousands, millions, ...) isn't an answer
+
+        self.hits += 1
+        excerpt = f"{fact['line_item']}, {fact['period']}: {fact['value_text']} (in {fact['unit']})"
+        return {
+            "answer": f"{company} {excerpt} [{fact['source']}, page {fact['page']}]",
+            "fact": fact,
+            "source": {"company": company, "year": str(year), "excerpt": excerpt, "page": fact["page"]},
+        }
+
+    def miss(self):
+        self.misses += 1
+        return None
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM facts").fetchone()[0]
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+if __name__ == "__main__":
+    # python fact_index.py "NVIDIA total revenue FY2024"
+    fact_index = FactIndex(FACT_INDEX_PATH)
+    for query in sys.argv[1:]:
+        result = fact_index.lookup(query)
+        print(result["answer"] if result else f"No single fact answers: {query}")
+    if len(sys.argv) == 1:
+        print(f"{fact_index.count()} facts in {FACT_INDEX_PATH}")
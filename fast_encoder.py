@@ -0,0 +1,225 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from config import (EMBEDDING_MODEL_NAME, ENCODER_BACKEND, ENCODER_BATCH_SIZE, ENCODER_WORKERS, ONNX_MODEL_DIR)
+
+# Accelerated CPU encoding for EMBEDDING_MODEL_NAME. The transformer is exported
+# to ONNX once (optionally with dynamic int8 quantization of its weights) and run
+# with ONNX Runtime; tokenization, pooling and normalization follow the
+# SentenceTransformer configuration so vectors stay comparable with the
+# reference model. Requires `onnxruntime` (and `torch` / `transformers` for the
+# one-time export, both already installed with sentence-transformers).
+
+ENCODER_BACKENDS = ('sentence_transformers', 'onnx', 'onnx_int8')
+
+
+def encoder_name(backend=ENCODER_BACKEND, model_name=EMBEDDING_MODEL_NAME):
+    """Name identifying the vectors a backend produces, e.g. for the embedding cache key."""
+    if backend == 'sentence_transformers':
+        return model_name # Keeps caches written before the ONNX backends existed valid
+    return f"{model_name}@{backend}"
+
+
+def export_onnx(model_name=EMBEDDING_MODEL_NAME, output_dir=ONNX_MODEL_DIR):
+    """
+    Exports the SentenceTransformer's transformer to ONNX and writes an int8
+    dynamically quantized copy next to it.
+
+    Files written to `output_dir`: model.onnx, model_int8.onnx, the tokenizer,
+    and encoder.json with the pooling mode, normalization and max sequence length.
+    """
+    import torch
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device='cpu')
+    transformer = model[0].auto_model.eval()
+    pooling = next((module for module in model if type(module).__name__ == 'Pooling'), None)
+    normalize = any(type(module).__name__ == 'Normalize' for module in model)
+
+    class TokenEmbeddings(torch.nn.Module):
+        # Only the last hidden state is needed; pooling runs in NumPy
+        def __init__(self, transformer):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, input_ids, attention_mask):
+            return self.transformer(input_ids=input_ids, attention_mask=attention_mask)[0]
+
+    os.makedirs(output_dir, exist_ok=True)
+    sample = model.tokenizer(["This excerpt is from company MSFT FY 2023."], return_tensors='pt')
+    model_path = os.path.join(output_dir, "model.onnx")
+    torch.onnx.export(
+        TokenEmbeddings(transformer),
+        (sample['input_ids'], sample['attention_mask']),
+        model_path,
+        input_names=['input_ids', 'attention_mask'],
+        output_names=['token_embeddings'],
+        dynamic_axes={name: {0: 'batch', 1: 'sequence'} for name in ('input_ids', 'attention_mask', 'token_embeddings')},
+        opset_version=14,
+    )
+    # Dynamic quantization: int8 weights, activations quantized on the fly, no calibration data needed
+    quantize_dynamic(model_path, os.path.join(output_dir, "model_int8.onnx"), weight_type=QuantType.QInt8)
+
+    model.tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, "encoder.json"), 'w') as f:
+        json.dump({
+            "model_name": model_name,
+            "pooling": "cls" if pooling is not None and pooling.pooling_mode_cls_token else "mean",
+            "normalize": normalize,
+            "max_seq_length": model.max_seq_length,
+        }, f)
+    print(f"Exported {model_name} to {output_dir} (model.onnx, model_int8.onnx)")
+
+
+class OnnxEncoder:
+    """
+    ONNX Runtime stand-in for SentenceTransformer.encode.
+
+    Texts are tokenized once, sorted by token count and batched so that each
+    batch is only padded to its own longest text; results are returned in the
+    input order.
+    """
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, quantized=True, batch_size=ENCODER_BATCH_SIZE, threads=None):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, "encoder.json"), 'r') as f:
+            settings = json.load(f)
+        self.pooling = settings["pooling"]
+        self.normalize = settings["normalize"]
+        self.max_length = settings["max_seq_length"]
+        self.batch_size = batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        model_file = "model_int8.onnx" if quantized else "model.onnx"
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, model_file), options, providers=['CPUExecutionProvider']
+        )
+
+    def encode(self, texts, batch_size=None, **kwargs):
+        """Encodes a string to a vector or a list of strings to a float32 array (extra kwargs are ignored)."""
+        if isinstance(texts, str):
+            return self.encode([texts], batch_size)[0]
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        batch_size = batch_size or self.batch_size
+
+        token_ids = self.tokenizer(texts, truncation=True, max_length=self.max_length)['input_ids']
+        order = sorted(range(len(texts)), key=lambda i: len(token_ids[i]))
+
+        vectors = None
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            length = max(len(token_ids[i]) for i in batch)
+            input_ids = np.full((len(batch), length), self.tokenizer.pad_token_id, dtype=np.int64)
+            attention_mask = np.zeros((len(batch), length), dtype=np.int64)
+            for row, i in enumerate(batch):
+                input_ids[row, :len(token_ids[i])] = token_ids[i]
+                attention_mask[row, :len(token_ids[i])] = 1
+
+            token_embeddings = self.session.run(None, {'input_ids': input_ids, 'attention_mask': attention_mask})[0]
+            if self.pooling == 'cls':
+                pooled = token_embeddings[:, 0]
+            else:
+                mask = attention_mask[:, :, None].astype(np.float32)
+                pooled = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            if self.normalize:
+                pooled = pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+            if vectors is None:
+                vectors = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+            vectors[batch] = pooled
+        return vectors
+
+
+# Encoder of the current worker process, created by init_worker
+worker_encoder = None
+
+
+def init_worker(backend, threads):
+    global worker_encoder
+    worker_encoder = load_encoder(backend, threads=threads)
+
+
+def encode_in_worker(texts):
+    return np.asarray(worker_encoder.encode(texts), dtype=np.float32)
+
+
+class ParallelEncoder:
+    """
+    Splits each encode call across `workers` processes, each holding its own
+    encoder with cpu_count / workers threads. Meant for large ingest batches;
+    use close() (or a with block) to shut the pool down.
+    """
+
+    def __init__(self, backend=ENCODER_BACKEND, workers=ENCODER_WORKERS):
+        self.workers = workers
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(backend, threads))
+
+    def encode(self, texts, **kwargs):
+        if isinstance(texts, str):
+            return self.encode([texts])[0]
+        texts = list(texts)
+        # Deal texts out by length so every worker gets a similar amount of work
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        shards = [order[worker::self.workers] for worker in range(self.workers)]
+        shards = [shard for shard in shards if shard]
+        results = self.executor.map(encode_in_worker, [[texts[i] for i in shard] for shard in shards])
+
+        vectors = None
+        for shard, shard_vectors in zip(shards, results):
+            if vectors is None:
+                vectors = np.empty((len(texts), shard_vectors.shape[1]), dtype=np.float32)
+            vectors[shard] = shard_vectors
+        return vectors if vectors is not None else np.zeros((0, 0), dtype=np.float32)
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_encoder(backend=ENCODER_BACKEND, threads=None):
+    """
+    Returns an object with a SentenceTransformer-style encode() for the configured backend.
+
+    'sentence_transformers' is the reference model; 'onnx' and 'onnx_int8' run the
+    exported model (exporting it to ONNX_MODEL_DIR first if needed).
+    """
+    if backend == 'sentence_transformers':
+        from sentence_transformers import SentenceTransformer
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        return SentenceTransformer(EMBEDDING_MODEL_NAME)
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown ENCODER_BACKEND '{backend}'; expected one of {', '.join(ENCODER_BACKENDS)}")
+
+    try:
+        import onnxruntime # noqa: F401
+    except ImportError as e:
+        raise ImportError(f"ENCODER_BACKEND '{backend}' needs onnxruntime: pip install onnxruntime") from e
+    try:
+        with open(os.path.join(ONNX_MODEL_DIR, "encoder.json"), 'r') as f:
+            exported_model = json.load(f)["model_name"]
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        exported_model = None
+    if exported_model != EMBEDDING_MODEL_NAME:
+        export_onnx(EMBEDDING_MODEL_NAME, ONNX_MODEL_DIR)
+    return OnnxEncoder(ONNX_MODEL_DIR, quantized=backend == 'onnx_int8', threads=threads)
+
+
+if __name__ == "__main__":
+    export_onnx()
@@ -0,0 +1,77 @@
+import re
+
+# Filings are named like 'nvda-10-k-2024.pdf'
+FILING_NAME_PATTERN = re.compile(r'([a-zA-Z]+)-10-k-(\d{4})\.pdf')
+
+# Ways each company is referred to in queries, keyed by the ticker used in filing names
+COMPANY_ALIASES = {
+    'NVDA': ('nvidia', 'nvda'),
+    'GOOG': ('google', 'alphabet', 'goog', 'googl'),
+    'MSFT': ('microsoft', 'msft'),
+}
+
+# Also matches years written like "FY2024"
+YEAR_PATTERN = re.compile(r'(?<!\d)(20\d{2})\b')
+
+# Wording that signals a comparison or a multi-part question, which needs decomposition
+COMPARISON_PATTERN = re.compile(
+    r'\b(compare[sd]?|comparison|comparing|versus|vs\.?|differ\w*|difference|trends?|between|across|each|all|over time)\b'
+)
+
+
+def parse_filing_name(file_name):
+    """
+    Extracts the normalized company and fiscal year from a filing's file name.
+
+    Returns:
+        (company, fiscal_year): the upper-cased ticker and the year as an int. For
+        names that don't follow the pattern, the file name and None.
+    """
+    match = FILING_NAME_PATTERN.match(file_name)
+    if not match:
+        return file_name, None
+    return match.group(1).upper(), int(match.group(2))
+
+
+def mentioned_companies(query_text):
+    """Returns the tickers of the companies a query refers to, in COMPANY_ALIASES order."""
+    lowered = query_text.lower()
+    return [company for company, aliases in COMPANY_ALIASES.items()
+            if any(re.search(rf'\b{alias}\b', lowered) for alias in aliases)]
+
+
+def is_simple_query(query_text):
+    """
+    Cheap local check for queries that need no LLM decomposition: exactly one
+    company and one fiscal year, and no comparison or multi-part wording.
+    """
+    return (len(mentioned_companies(query_text)) == 1
+            and len(set(YEAR_PATTERN.findall(query_text))) == 1
+            and not COMPARISON_PATTERN.search(query_text.lower()))
+
+
+def infer_where(query_text):
+    """
+    Builds a ChromaDB `where` filter from the companies and fiscal years mentioned in a query.
+
+    Years are expanded to the full range between the earliest and latest one
+    mentioned, so "from 2022 to 2024" also covers 2023.
+
+    Returns:
+        A filter on the `company` and/or `fiscal_year` metadata fields, or None if
+        the query names neither.
+    """
+    companies = mentioned_companies(query_text)
+    years = [int(year) for year in YEAR_PATTERN.findall(query_text)]
+    if years:
+        years = list(range(min(years), max(years) + 1))
+
+    conditions = []
+    if companies:
+        conditions.append({"company": companies[0]} if len(companies) == 1 else {"company": {"$in": companies}})
+    if years:
+        conditions.append({"fiscal_year": years[0]} if len(years) == 1 else {"fiscal_year": {"$in": years}})
+
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
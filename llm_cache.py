@@ -0,0 +1,140 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from tracing import annotate
+
+
+class CachedResponse:
+    """Minimal stand-in for a Gemini response served from the cache."""
+
+    def __init__(self, text):
+        self.text = text
+
+
+class LLMCache:
+    """
+    Persistent LLM response cache in SQLite, keyed by model name + prompt hash.
+
+    Entries older than `ttl_seconds` are ignored (and purged), and once more than
+    `max_entries` are stored the least recently used ones are evicted. Safe to
+    share between threads.
+    """
+
+    def __init__(self, path, ttl_seconds=None, max_entries=None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT, created REAL, last_used REAL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    @staticmethod
+    def key(model_name, prompt, **kwargs):
+        payload = json.dumps([model_name, prompt, kwargs], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Returns the cached response text for `key`, or None on a miss or expired entry."""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                with self.conn:
+                    self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            with self.conn:
+                self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, model_name, response_text):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, model_name, response_text, now, now)
+            )
+            if self.max_entries is not None:
+                # Evict least recently used entries beyond the size limit
+                self.conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+
+    def delete(self, key):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class CachedModel:
+    """
+    Wraps a GenerativeModel so generate_content is answered from an LLMCache when
+    the same prompt was already sent to the same model. Pass cache=None to bypass.
+    """
+
+    def __init__(self, model, cache):
+        self.model = model
+        self.cache = cache
+        self.model_name = getattr(model, "model_name", type(model).__name__)
+
+    def __getattr__(self, name):
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def generate_content(self, prompt, **kwargs):
+        # Streamed and complete responses to the same prompt share one cache entry
+        stream = kwargs.pop("stream", False)
+        model_kwargs = dict(kwargs, stream=True) if stream else kwargs
+        if self.cache is None:
+            return self.model.generate_content(prompt, **model_kwargs)
+
+        key = LLMCache.key(self.model_name, prompt, **kwargs)
+        cached_text = self.cache.get(key)
+        # Recorded on the caller's span, e.g. "synthesis", when a trace is active
+        annotate(cache_hit=cached_text is not None)
+        if cached_text is not None:
+            # A cache hit "streams" as a single chunk
+            return iter([CachedResponse(cached_text)]) if stream else CachedResponse(cached_text)
+
+        if stream:
+            return self.stream_and_cache(key, prompt, **model_kwargs)
+        response = self.model.generate_content(prompt, **kwargs)
+        try:
+            self.cache.put(key, self.model_name, response.text)
+        except ValueError:
+            pass # Blocked/empty responses have no text to cache
+        return response
+
+    def forget(self, prompt, **kwargs):
+        """Drops the cached response to a prompt, e.g. one the caller couldn't use, so it is requested again."""
+        if self.cache is not None:
+            self.cache.delete(LLMCache.key(self.model_name, prompt, **kwargs))
+
+    def stream_and_cache(self, key, prompt, **kwargs):
+        """Passes streamed chunks through, caching the full text once the stream completes."""
+        pieces = []
+        complete = True
+        for chunk in self.model.generate_content(prompt, **kwargs):
+            try:
+                pieces.append(chunk.text)
+            except ValueError:
+                complete = False # Blocked chunk; don't cache a partial response
+            yield chunk
+        if complete:
+            self.cache.put(key, self.model_name, "".join(pieces))
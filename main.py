@@ -1,13 +1,143 @@
+import time
+STARTUP_START = time.perf_counter() # Taken before the other imports so --profile-startup covers them
+
 import argparse
-from sentence_transformers import SentenceTransformer
-import chromadb
+from concurrent.futures import ThreadPoolExecutor
 import json
-import google.generativeai as genai
+import threading
 from rag_agent import agentic_rag_query # Assuming agentic_rag_query returns a Python dict
-from config import COLLECTION_NAME, EMBEDDING_MODEL_NAME
-from embedding import create_embeddings
+from config import COLLECTION_NAME, QUERY_CONCURRENCY, LLM_REQUESTS_PER_MINUTE, TRACE_SPAN_HOOKS, PIPELINED_QUERIES
+from pipeline import load_embedding_model, open_collection, open_fact_index, load_llms
+from server import query_server
+from semantic_cache import SemanticCache
+from startup_profile import StartupProfiler
+from tracing import MetricsRegistry, load_span_hooks
+
+# Heavy dependencies are only imported on the code path that needs them: the PDF
+# stack (via embedding.py) only when the collection has to be created, torch /
+# chromadb / the Gemini SDK inside the pipeline.py loaders.
+
+
+def error_result(query, e):
+    return {
+        "question": query,
+        "answer": "Error processing query.",
+        "reasoning": f"Error processing query: {e}",
+        "sub_queries": [],
+        "sources": [],
+        "error": True
+    }
+
+
+def run_ordered(run_one, queries, concurrency=1, on_result=None):
+    """
+    Applies run_one to every query, `concurrency` at a time, returning results in input order.
+
+    on_result, if given, is called with each result as soon as it finishes (from worker threads).
+    """
+    if on_result is not None:
+        run_query = run_one
+
+        def run_one(query):
+            result = run_query(query)
+            on_result(result)
+            return result
+
+    if concurrency <= 1:
+        return [run_one(query) for query in queries]
+
+    # Executor.map yields results in input order regardless of completion order
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(run_one, queries))
+
+
+def run_queries(queries, collection, embedding_model, decomposition_model, synthesis_model, concurrency=1,
+                on_result=None, on_token=None, pipelined=PIPELINED_QUERIES, semantic_cache=None, fact_index=None):
+    """
+    Runs agentic_rag_query for every query, `concurrency` queries at a time.
+
+    The models only need a generate_content(prompt) method, so local stubs can be
+    passed in place of genai.GenerativeModel (with stream=True support when on_token is set).
+
+    Args:
+        on_result: Optional callback receiving each result as soon as its query finishes.
+        on_token: Optional callback receiving synthesis text as it streams in.
+        pipelined: Overlap retrieval with decomposition (see rag_agent.pipelined_retrieval).
+        semantic_cache: Optional SemanticCache shared by all queries of the batch.
+        fact_index: Optional FactIndex answering single-figure lookups without the LLM.
+
+    Returns:
+        A list of result dictionaries in the same order as `queries`.
+    """
+    def run_one(query):
+        print(f"Processing query: {query}")
+        try:
+            return agentic_rag_query(
+                query, collection, embedding_model, decomposition_model, synthesis_model,
+                on_token=on_token, pipelined=pipelined, semantic_cache=semantic_cache, fact_index=fact_index
+            )
+        except Exception as e:
+            # Keep one failing query from aborting the rest of the batch
+            print(f"Error processing query '{query}': {e}")
+            return error_result(query, e)
+
+    return run_ordered(run_one, queries, concurrency, on_result)
+
+
+def run_queries_remote(queries, server_url, concurrency=1, on_result=None):
+    """Sends every query to a running server.py instance, returning results in input order."""
+    def run_one(query):
+        print(f"Processing query: {query}")
+        try:
+            return query_server(server_url, query)
+        except Exception as e:
+            print(f"Error processing query '{query}': {e}")
+            return error_result(query, e)
+
+    return run_ordered(run_one, queries, concurrency, on_result)
+
+
+def completed_questions(path):
+    """
+    Returns the questions already answered in an NDJSON output file, so a rerun can skip them.
+
+    Results marked "error" (a failed query or synthesis) don't count, so those queries run again.
+    """
+    questions = set()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                    if not result.get("error"):
+                        questions.add(result["question"])
+                except (ValueError, KeyError, AttributeError):
+                    pass # e.g. a line cut short by a crash; that query simply runs again
+    except FileNotFoundError:
+        pass
+    return questions
+
+
+def ndjson_appender(path):
+    """Returns a thread-safe callback that appends each result to `path` as one JSON line and flushes it."""
+    lock = threading.Lock()
+
+    def append(result):
+        line = json.dumps(result) + "\n"
+        with lock, open(path, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+    return append
+
+
+def print_token(text):
+    print(text, end="", flush=True)
+
 
 def main():
+    profiler = StartupProfiler(STARTUP_START)
+    profiler.phases.append(("module imports", time.perf_counter() - STARTUP_START))
+
     parser = argparse.ArgumentParser(description="Run Agentic RAG Query with multiple queries.")
     parser.add_argument(
         "--query_file",
@@ -21,8 +151,68 @@ def main():
         default="rag_results.json",
         help="Path to save the output JSON file"
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=QUERY_CONCURRENCY,
+        help="Number of queries to process concurrently"
+    )
+    parser.add_argument(
+        "--requests_per_minute",
+        type=float,
+        default=LLM_REQUESTS_PER_MINUTE,
+        help="Rate limit shared by all Gemini generate_content calls"
+    )
+    parser.add_argument(
+        "--no_llm_cache",
+        action="store_true",
+        help="Bypass the local LLM response cache and always call Gemini"
+    )
+    parser.add_argument(
+        "--no_semantic_cache",
+        action="store_true",
+        help="Search the collection for every sub-query, even near-duplicates of earlier ones"
+    )
+    parser.add_argument(
+        "--no_fact_index",
+        action="store_true",
+        help="Answer every query through retrieval and synthesis, even lookups of single reported figures"
+    )
+    parser.add_argument(
+        "--server_url",
+        type=str,
+        default=None,
+        help="Send queries to a running server.py (e.g. http://127.0.0.1:8765) instead of loading models locally"
+    )
+
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        default=PIPELINED_QUERIES,
+        help="Retrieve while the decomposition streams in, and skip decomposition for simple queries"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream synthesis output to the terminal and append each result to output_file as NDJSON "
+             "as soon as it finishes; queries already in output_file are skipped"
+    )
+    parser.add_argument(
+        "--metrics_file",
+        type=str,
+        default=None,
+        help="Path to save per-stage latency histograms aggregated over the batch"
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Report import and model loading times and the time to the first retrieval"
+    )
 
     args = parser.parse_args()
+    if args.profile_startup:
+        profiler.install_import_timer()
+    load_span_hooks(TRACE_SPAN_HOOKS)
 
     # Load queries from the text file, one per line
     try:
@@ -39,32 +229,83 @@ def main():
         print("No queries found in the file.")
         return
 
-    # Initialize embedding model
-    embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    on_result = on_token = None
+    if args.stream:
+        # Resume: skip queries whose results a previous (possibly interrupted) run already wrote
+        done = completed_questions(args.output_file)
+        queries = [query for query in queries if query not in done]
+        if done:
+            print(f"Skipping {len(done)} queries already in {args.output_file}; {len(queries)} remaining.")
+        if not queries:
+            return
+        on_result = ndjson_appender(args.output_file)
+        # Tokens of concurrent queries would interleave on the terminal
+        on_token = print_token if args.concurrency <= 1 else None
 
-    # Initialize ChromaDB (in-memory for now, or connect to persistent one)
-    client = chromadb.PersistentClient(path="./chroma_db")
-    try:
-        collection = client.get_collection(COLLECTION_NAME)
-    except Exception as e:
-        print(f"Error getting collection: {e}")
-        print(f"Creating the collection '{COLLECTION_NAME}' ")
-        create_embeddings(COLLECTION_NAME)
-        return
+    llm_cache = semantic_cache = fact_index = None
+    if args.server_url:
+        # Thin client: the server already has the models and collection loaded
+        results = run_queries_remote(queries, args.server_url, concurrency=args.concurrency, on_result=on_result)
+    else:
+        # Initialize embedding model
+        with profiler.phase("load embedding model"):
+            embedding_model = load_embedding_model()
 
+        with profiler.phase("open collection"):
+            collection = open_collection()
+        if collection is None:
+            from embedding import create_embeddings # Pulls in the PDF partitioning stack
 
-    # Load other models
-    decomposition_model = genai.GenerativeModel('gemini-2.5-flash')
-    synthesis_model = genai.GenerativeModel('gemini-2.5-flash')
+            print(f"Creating the collection '{COLLECTION_NAME}' ")
+            create_embeddings(COLLECTION_NAME)
+            return
+        if args.profile_startup:
+            collection = profiler.watch_collection(collection)
 
-    results = []
-    for query in queries:
-        print(f"Processing query: {query}")
-        # Assuming agentic_rag_query now returns a Python dictionary
-        agentic_result_dict = agentic_rag_query(
-            query, collection, embedding_model, decomposition_model, synthesis_model
+        semantic_cache = None if args.no_semantic_cache else SemanticCache()
+        fact_index = None if args.no_fact_index else open_fact_index()
+
+        # Load other models
+        with profiler.phase("load LLM clients"):
+            decomposition_model, synthesis_model, llm_cache = load_llms(args.requests_per_minute, not args.no_llm_cache)
+
+        results = run_queries(
+            queries, collection, embedding_model, decomposition_model, synthesis_model,
+            concurrency=args.concurrency, on_result=on_result, on_token=on_token,
+            pipelined=args.pipelined, semantic_cache=semantic_cache, fact_index=fact_index
         )
-        results.append(agentic_result_dict)
+
+    if llm_cache is not None:
+        stats = llm_cache.stats()
+        print(f"LLM cache: {stats['hits']} hits, {stats['misses']} misses.")
+    if semantic_cache is not None:
+        stats = semantic_cache.stats()
+        if stats["hit_rate"] is not None:
+            print(f"Semantic cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate).")
+    if fact_index is not None:
+        stats = fact_index.stats()
+        print(f"Fact index: answered {stats['hits']} of {stats['hits'] + stats['misses']} lookups.")
+
+    # Aggregate the per-query `timings` (also returned by server.py) into histograms
+    metrics = MetricsRegistry()
+    for result in results:
+        metrics.observe_timings(result.get("timings"))
+    metrics.report()
+    if args.metrics_file:
+        try:
+            with open(args.metrics_file, 'w', encoding='utf-8') as f:
+                json.dump(metrics.snapshot(), f, indent=4)
+            print(f"Stage metrics saved to {args.metrics_file}")
+        except IOError as e:
+            print(f"Error saving stage metrics to {args.metrics_file}: {e}")
+
+    if args.profile_startup:
+        profiler.uninstall_import_timer()
+        profiler.report()
+
+    if args.stream:
+        print(f"Results appended to {args.output_file}")
+        return
 
     # Save results to a JSON file
     try:
@@ -0,0 +1,30 @@
+import json
+import os
+from config import CHROMA_PATH
+
+# The ingest manifest records what create_embeddings (embedding.py) has put into
+# a collection. Kept out of embedding.py so the query path can check it (see
+# semantic_cache.py) without importing the ingest stack.
+
+
+def manifest_path(collection_name):
+    # The manifest lives next to the collection so wiping ./chroma_db also resets it
+    return os.path.join(CHROMA_PATH, f"{collection_name}_manifest.json")
+
+
+def load_manifest(collection_name):
+    """Loads the ingest manifest ({"files": {file_name: {"hash", "chunk_ids"}}, "generation": int, ...})."""
+    try:
+        with open(manifest_path(collection_name), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"files": {}}
+
+
+def save_manifest(collection_name, manifest):
+    path = manifest_path(collection_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path) # Atomic swap so a crash never leaves a half-written manifest
@@ -0,0 +1,154 @@
+import io
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from unstructured.partition.pdf import partition_pdf
+from config import INGEST_WORKERS, PAGES_PER_TASK, PARTITION_LOOKAHEAD_FILES, ELEMENT_CACHE_DIR
+from element_cache import ElementCache, PARTITION_SETTINGS
+
+
+def partition_file(file_path, page_range=None):
+    """
+    Partitions a PDF, or a page range of it, into unstructured elements.
+
+    Args:
+        file_path: Path to the PDF.
+        page_range: Optional (start, end) tuple of zero-based page indices, end exclusive.
+
+    Returns:
+        A list of elements. Page numbers refer to the original document.
+    """
+    if page_range is None:
+        return partition_pdf(
+            filename=file_path,
+            # No automatic chunking (overlap and custom headers are handled by chunker.py)
+            # and tables extracted as separate elements; see PARTITION_SETTINGS
+            **PARTITION_SETTINGS
+        )
+
+    from pypdf import PdfReader, PdfWriter
+
+    # Copy the requested pages into an in-memory PDF and partition just that
+    start, end = page_range
+    writer = PdfWriter()
+    for page in PdfReader(file_path).pages[start:end]:
+        writer.add_page(page)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    buffer.seek(0)
+
+    return partition_pdf(
+        file=buffer,
+        metadata_filename=os.path.basename(file_path),
+        starting_page_number=start + 1, # Keep page numbers relative to the full filing
+        **PARTITION_SETTINGS
+    )
+
+
+def page_ranges(file_path, pages_per_task):
+    """Splits a PDF into (start, end) page ranges of at most `pages_per_task` pages."""
+    from pypdf import PdfReader
+
+    page_count = len(PdfReader(file_path).pages)
+    if page_count <= pages_per_task:
+        return [None] # Small enough to partition in one task
+    return [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+
+
+def partition_files(file_paths, workers=INGEST_WORKERS, pages_per_task=PAGES_PER_TASK, cache_dir=ELEMENT_CACHE_DIR,
+                    lookahead=PARTITION_LOOKAHEAD_FILES):
+    """
+    Partitions PDFs, fanning files (and page ranges of large files) out to a process pool.
+
+    Results are yielded in the order of `file_paths` as soon as each file is
+    complete, with the elements of split files merged back in page order, so the
+    output is identical to partitioning the files one at a time.
+
+    Files already partitioned with the same content and settings are loaded from
+    the element cache in `cache_dir` (None disables it) instead of being parsed
+    again; newly partitioned files are added to it.
+
+    With a process pool, only the next `lookahead` files after the one being
+    yielded are submitted (or loaded from the cache) at a time, so memory stays
+    bounded however many files are passed.
+
+    Yields:
+        (file_path, elements, error) tuples. `error` is the exception raised while
+        partitioning that file (and `elements` is None), otherwise None.
+    """
+    cache = ElementCache(cache_dir) if cache_dir else None
+
+    def cached(file_path):
+        # (cache key, cached elements or None); lookup failures just mean re-parsing
+        if cache is None:
+            return None, None
+        try:
+            key = cache.key(file_path)
+        except OSError:
+            return None, None
+        return key, cache.get(key)
+
+    def store(key, elements):
+        if key is not None:
+            try:
+                cache.put(key, elements)
+            except Exception as e:
+                print(f"Could not cache elements: {e}")
+
+    if workers <= 1:
+        for file_path in file_paths:
+            key, elements = cached(file_path)
+            if elements is not None:
+                yield file_path, elements, None
+                continue
+            try:
+                elements = partition_file(file_path)
+            except Exception as e:
+                yield file_path, None, e
+                continue
+            store(key, elements)
+            yield file_path, elements, None
+        return
+
+    def submit(executor, file_path):
+        # (file_path, cache key, cached elements, futures per page range, error)
+        key, elements = cached(file_path)
+        if elements is not None:
+            return file_path, key, elements, [], None
+        try:
+            futures = [executor.submit(partition_file, file_path, page_range)
+                       for page_range in page_ranges(file_path, pages_per_task)]
+            return file_path, key, None, futures, None
+        except Exception as e:
+            return file_path, key, None, [], e
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Keep a window of files submitted ahead of the one being yielded, so the pool
+        # stays busy across file boundaries without holding every file's elements at once
+        remaining = iter(file_paths)
+        window = deque()
+        while True:
+            for file_path in islice(remaining, lookahead + 1 - len(window)):
+                window.append(submit(executor, file_path))
+            if not window:
+                return
+
+            file_path, key, elements, futures, error = window.popleft()
+            if error is not None:
+                yield file_path, None, error
+                continue
+            if elements is not None:
+                yield file_path, elements, None
+                continue
+            try:
+                elements = []
+                for future in futures:
+                    elements.extend(future.result())
+            except Exception as e:
+                for future in futures:
+                    future.cancel()
+                yield file_path, None, e
+                continue
+            store(key, elements)
+            yield file_path, elements, None
@@ -0,0 +1,101 @@
+import os
+from config import (COLLECTION_NAME, CHROMA_PATH,
+                    LLM_REQUESTS_PER_MINUTE, LLM_MAX_RETRIES,
+                    LLM_CACHE_PATH, LLM_CACHE_TTL_SECONDS, LLM_CACHE_MAX_ENTRIES,
+                    RETRIEVAL_BACKEND, NUMPY_INDEX_DIR, CHUNK_STORE_DIR, CHROMA_STORE_DOCUMENTS,
+                    FACT_INDEX_PATH)
+from rate_limit import TokenBucket, RateLimitedModel
+from llm_cache import LLMCache, CachedModel
+
+# Heavy dependencies (torch via sentence_transformers, chromadb, the Gemini SDK)
+# are imported inside the functions that need them so that importing this
+# module, and the query path through main.py, stays fast.
+
+
+def load_embedding_model():
+    # SentenceTransformer, or its ONNX Runtime export, according to ENCODER_BACKEND
+    from fast_encoder import load_encoder
+
+    return load_encoder()
+
+
+def configure_genai():
+    """Configures the Gemini SDK from GOOGLE_API_KEY (a .env file is honoured) and returns the module."""
+    import google.generativeai as genai
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+    return genai
+
+
+def open_collection():
+    """
+    Opens the collection queries are served from, according to RETRIEVAL_BACKEND.
+
+    When chunk texts are kept in the chunk store rather than in ChromaDB
+    (CHROMA_STORE_DOCUMENTS = False), the collection is wrapped so that query
+    results are hydrated from the store.
+
+    Returns:
+        The ChromaDB collection or NumpyIndex, or None if the ChromaDB collection
+        has not been created yet.
+    """
+    collection = open_index()
+    if collection is not None and not CHROMA_STORE_DOCUMENTS:
+        from chunk_store import HydratedCollection
+        collection = HydratedCollection(collection, CHUNK_STORE_DIR)
+    return collection
+
+
+def open_index():
+    # The ChromaDB collection, or its NumPy export when RETRIEVAL_BACKEND is 'numpy'
+    if RETRIEVAL_BACKEND == 'numpy':
+        # Serve queries from the memory-mapped export; ChromaDB isn't opened at all
+        from vector_index import NumpyIndex
+        try:
+            return NumpyIndex(NUMPY_INDEX_DIR)
+        except FileNotFoundError:
+            print(f"No NumPy index found at {NUMPY_INDEX_DIR}; exporting it from '{COLLECTION_NAME}'")
+
+    import chromadb
+
+    # Initialize ChromaDB (in-memory for now, or connect to persistent one)
+    client = chromadb.PersistentClient(path=CHROMA_PATH)
+    try:
+        collection = client.get_collection(COLLECTION_NAME)
+    except Exception as e:
+        print(f"Error getting collection: {e}")
+        return None
+
+    if RETRIEVAL_BACKEND == 'numpy':
+        from vector_index import NumpyIndex, export_chroma_collection
+        export_chroma_collection(collection, NUMPY_INDEX_DIR)
+        return NumpyIndex(NUMPY_INDEX_DIR)
+    return collection
+
+
+def open_fact_index():
+    """Opens the financial fact index built at ingest, or returns None if it is disabled or not built yet."""
+    if not FACT_INDEX_PATH or not os.path.exists(FACT_INDEX_PATH):
+        return None
+    from fact_index import FactIndex
+    return FactIndex(FACT_INDEX_PATH)
+
+
+def load_llms(requests_per_minute=LLM_REQUESTS_PER_MINUTE, use_llm_cache=True):
+    """
+    Builds the decomposition and synthesis models.
+
+    Both share one rate limit since they hit the same API quota. The response
+    cache sits in front so cache hits skip the rate limiter entirely.
+
+    Returns:
+        (decomposition_model, synthesis_model, llm_cache); llm_cache is None when bypassed.
+    """
+    genai = configure_genai()
+    bucket = TokenBucket(rate=requests_per_minute / 60.0)
+    llm_cache = LLMCache(LLM_CACHE_PATH, LLM_CACHE_TTL_SECONDS, LLM_CACHE_MAX_ENTRIES) if use_llm_cache else None
+    decomposition_model = CachedModel(RateLimitedModel(genai.GenerativeModel('gemini-2.5-flash'), bucket, max_retries=LLM_MAX_RETRIES), llm_cache)
+    synthesis_model = CachedModel(RateLimitedModel(genai.GenerativeModel('gemini-2.5-flash'), bucket, max_retries=LLM_MAX_RETRIES), llm_cache)
+    return decomposition_model, synthesis_model, llm_cache
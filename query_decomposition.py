@@ -1,42 +1,18 @@
-import os
-from dotenv import load_dotenv
-
-import google.generativeai as genai
-from google.colab import userdata
+from typing import TYPE_CHECKING
 import re # Import regular expression module
+from tracing import annotate
 
-# Initialize the Gemini API
-# Make sure you have added your GOOGLE_API_KEY to Colab secrets
-# GOOGLE_API_KEY = userdata.get('GOOGLE_API_KEY')
-genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
-
-# Initialize the Generative Model
-# Use an appropriate Gemini model name, e.g., 'gemini-1.5-flash-latest' or 'gemini-1.0-pro'
-try:
-    decomposition_model = genai.GenerativeModel('gemini-2.5-flash')
-except Exception as e:
-    print(f"Could not initialize model: {e}")
-    print("Please ensure you have access to the specified Gemini model and your API key is correct.")
-    decomposition_model = None # Set to None if model initialization fails
+if TYPE_CHECKING:
+    # Only needed for annotations; the Gemini SDK is configured and imported in pipeline.py
+    import google.generativeai as genai
 
 
-def decompose_query(query: str, model: genai.GenerativeModel) -> list[str]:
-    """
-    Decomposes a complex query into simpler sub-queries using a Gemini LLM.
+SUB_QUERY_PATTERN = re.compile(r'^\d+\.\s*(.*)', re.MULTILINE)
 
-    Args:
-        query: The complex user query.
-        model: The initialized Gemini GenerativeModel.
 
-    Returns:
-        A list of sub-queries.
-    """
-    if model is None:
-        print("LLM model is not initialized. Cannot perform query decomposition.")
-        return [query] # Return original query if model is not available
-
-    try:
-        prompt = f"""\
+def decomposition_prompt(query: str) -> str:
+    # Shared by decompose_query and iter_sub_queries so both hit the same LLM cache entries
+    return f"""\
         You are an intelligent query agent designed to answer complex questions using a structured, multi-step approach. 
         Your task is to break down complex queries, perform multiple retrievals if needed, and synthesize coherent, accurate responses.
 
@@ -54,12 +30,32 @@ def decompose_query(query: str, model: genai.GenerativeModel) -> list[str]:
 
         Provide the sub-queries as a numbered list.
 """
+
+
+def decompose_query(query: str, model: "genai.GenerativeModel") -> list[str]:
+    """
+    Decomposes a complex query into simpler sub-queries using a Gemini LLM.
+
+    Args:
+        query: The complex user query.
+        model: The initialized Gemini GenerativeModel.
+
+    Returns:
+        A list of sub-queries.
+    """
+    if model is None:
+        print("LLM model is not initialized. Cannot perform query decomposition.")
+        return [query] # Return original query if model is not available
+
+    try:
+        prompt = decomposition_prompt(query)
         response = model.generate_content(prompt)
 
         # Parse the response to extract sub-queries using regex for more robust parsing
         sub_queries_text = response.text
+        annotate(prompt_chars=len(prompt), response_chars=len(sub_queries_text))
         # Look for lines starting with a number followed by a period and space (e.g., "1. ")
-        sub_queries = re.findall(r'^\d+\.\s*(.*)', sub_queries_text, re.MULTILINE)
+        sub_queries = SUB_QUERY_PATTERN.findall(sub_queries_text)
         sub_queries = [q.strip() for q in sub_queries if q.strip()] # Ensure no empty strings
 
         return sub_queries
@@ -67,7 +63,62 @@ def decompose_query(query: str, model: genai.GenerativeModel) -> list[str]:
         print(f"Error during query decomposition: {e}")
         return [query] 
 
+
+def iter_sub_queries(query: str, model: "genai.GenerativeModel"):
+    """
+    Streams the decomposition of `query`, yielding each sub-query as soon as its
+    line of the numbered list has been generated.
+
+    Args:
+        query: The complex user query.
+        model: A model whose generate_content supports stream=True.
+
+    Yields:
+        Sub-queries in order. Falls back to the original query if decomposition
+        fails before producing any sub-query.
+    """
+    if model is None:
+        print("LLM model is not initialized. Cannot perform query decomposition.")
+        yield query
+        return
+
+    prompt = decomposition_prompt(query)
+    produced = 0
+    response_chars = 0
+    pending = ""
+    try:
+        for chunk in model.generate_content(prompt, stream=True):
+            response_chars += len(chunk.text)
+            pending += chunk.text
+            # Only complete lines can be parsed; the last one may still be growing
+            *lines, pending = pending.split("\n")
+            for line in lines:
+                for sub_query in SUB_QUERY_PATTERN.findall(line):
+                    if sub_query.strip():
+                        produced += 1
+                        yield sub_query.strip()
+        for sub_query in SUB_QUERY_PATTERN.findall(pending):
+            if sub_query.strip():
+                produced += 1
+                yield sub_query.strip()
+        annotate(prompt_chars=len(prompt), response_chars=response_chars)
+    except Exception as e:
+        print(f"Error during query decomposition: {e}")
+        if not produced:
+            yield query
+
 if __name__=="__main__":
+    from pipeline import configure_genai
+
+    # Make sure GOOGLE_API_KEY is set in the environment (or a .env file)
+    genai = configure_genai()
+    try:
+        decomposition_model = genai.GenerativeModel('gemini-2.5-flash')
+    except Exception as e:
+        print(f"Could not initialize model: {e}")
+        print("Please ensure you have access to the specified Gemini model and your API key is correct.")
+        decomposition_model = None # Set to None if model initialization fails
+
     complex_query = "Compare the revenue growth and key risks of Microsoft and Google in 2023."
     sub_queries = decompose_query(complex_query, decomposition_model)
     print("Original Query:", complex_query)
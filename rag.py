@@ -1,27 +1,125 @@
-def rag_query(query_text, collection, embedding_model, n_results=10):
-    # Generate embedding for the query
-    query_embedding = embedding_model.encode(query_text).tolist()
+import json
+from filings import infer_where
+from semantic_cache import collection_fingerprint
+from tracing import span
 
-    # Perform similarity search in ChromaDB
-    results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=n_results,
-        include=['documents', 'metadatas']
-    )
 
-    # Extract relevant documents and metadatas and return them as a list of dictionaries
-    retrieved_sources = []
-    if results and results['documents'] and results['metadatas']:
-        for chunk, metadata in zip(results['documents'][0], results['metadatas'][0]):
-            retrieved_sources.append({
-                "content": chunk,
-                "metadata": metadata
-            })
+def rag_query_batch(query_texts, collection, embedding_model, n_results=10, where=None, infer_filters=False,
+                    semantic_cache=None):
+    """
+    Retrieves the top chunks for several queries at once.
 
-    return retrieved_sources
+    All queries are encoded in a single embedding_model.encode call. Queries that
+    share the same metadata filter are searched with a single collection.query call.
+
+    Args:
+        query_texts: The queries to search for.
+        collection: The ChromaDB collection.
+        embedding_model: The embedding model used to encode the queries.
+        n_results: The number of results to retrieve per query.
+        where: Optional ChromaDB `where` filter applied to every query.
+        infer_filters: If True and `where` is None, infer a company / fiscal year
+            filter from each query's text. Queries whose filter matches nothing
+            fall back to an unfiltered search.
+        semantic_cache: Optional SemanticCache; queries similar to a recent one with the
+            same filter reuse its results instead of searching the collection.
+
+    Returns:
+        A list with, for each query, a list of {"id", "content", "metadata", "distance"}
+        dictionaries, closest first.
+    """
+    if not query_texts:
+        return []
+
+    # Generate embeddings for all queries in one forward pass
+    with span("embed", queries=len(query_texts)):
+        query_embeddings = embedding_model.encode(list(query_texts)).tolist()
+
+    if where is not None:
+        filters = [where] * len(query_texts)
+    elif infer_filters:
+        filters = [infer_where(query_text) for query_text in query_texts]
+    else:
+        filters = [None] * len(query_texts)
+
+    batch_sources = [None] * len(query_texts)
+    if semantic_cache is not None:
+        with span("semantic_cache", queries=len(query_texts)) as attributes:
+            fingerprint = collection_fingerprint(collection)
+            for i, (embedding, query_filter) in enumerate(zip(query_embeddings, filters)):
+                batch_sources[i] = semantic_cache.get(embedding, query_filter, n_results, fingerprint)
+            attributes["hits"] = sum(sources is not None for sources in batch_sources)
+
+    # Search the collection only for queries the cache couldn't answer
+    missing = [i for i, sources in enumerate(batch_sources) if sources is None]
+    if missing:
+        searched = search_grouped(collection, [query_embeddings[i] for i in missing], [filters[i] for i in missing], n_results)
+        for i, sources in zip(missing, searched):
+            batch_sources[i] = sources
+
+    if infer_filters and where is None:
+        # An inferred filter can be too narrow (e.g. a year that isn't in the corpus)
+        retry = [i for i in missing if not batch_sources[i] and filters[i] is not None]
+        if retry:
+            retried = search_grouped(collection, [query_embeddings[i] for i in retry], [None] * len(retry), n_results)
+            for i, sources in zip(retry, retried):
+                batch_sources[i] = sources
+
+    if semantic_cache is not None:
+        for i in missing:
+            semantic_cache.put(query_embeddings[i], filters[i], n_results, fingerprint, batch_sources[i])
+
+    return batch_sources
+
+
+def search_grouped(collection, query_embeddings, filters, n_results):
+    """Runs one collection.query per distinct filter and returns the sources in query order."""
+    groups = {}
+    for i, where in enumerate(filters):
+        groups.setdefault(json.dumps(where, sort_keys=True), []).append(i)
+
+    batch_sources = [[] for _ in query_embeddings]
+    for indices in groups.values():
+        where = filters[indices[0]]
+        query_kwargs = {"where": where} if where is not None else {}
+
+        # Perform similarity search in ChromaDB for every query in the group in one round trip
+        with span("search", query_indices=indices, where=where, n_results=n_results):
+            results = collection.query(
+                query_embeddings=[query_embeddings[i] for i in indices],
+                n_results=n_results,
+                include=['documents', 'metadatas', 'distances'],
+                **query_kwargs
+            )
+
+        # Extract relevant documents, metadatas and scores per query
+        if results and results['documents'] and results['metadatas']:
+            for row, i in enumerate(indices):
+                for chunk_id, chunk, metadata, distance in zip(results['ids'][row], results['documents'][row],
+                                                               results['metadatas'][row], results['distances'][row]):
+                    batch_sources[i].append({
+                        "id": chunk_id,
+                        "content": chunk,
+                        "metadata": metadata,
+                        "distance": distance
+                    })
+
+    return batch_sources
+
+
+def rag_query(query_text, collection, embedding_model, n_results=10, where=None, infer_filter=False, semantic_cache=None):
+    # Single-query convenience wrapper around rag_query_batch
+    return rag_query_batch(
+        [query_text], collection, embedding_model, n_results=n_results, where=where, infer_filters=infer_filter,
+        semantic_cache=semantic_cache
+    )[0]
 
 
 if __name__=="__main__":
+    from pipeline import load_embedding_model, open_collection
+
+    embedding_model = load_embedding_model()
+    collection = open_collection()
     query = "What are the key risks for Microsoft in 2023?"
     retrieved_context = rag_query(query, collection, embedding_model)
-    print(retrieved_context) # This will now print a list of dictionaries
\ No newline at end of file
+    print(retrieved_context) # This will now print a list of dictionaries
@@ -1,21 +1,23 @@
+import contextvars
 import json
-import google.generativeai as genai
-from google.colab import userdata
-import os
-import re
-from rag import rag_query
-from query_decomposition import decompose_query
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+from rag import rag_query_batch
+from config import PIPELINED_QUERIES
+from filings import is_simple_query
+from query_decomposition import decompose_query, iter_sub_queries
+from context import assemble_context
+from tracing import traced, span
 
+if TYPE_CHECKING:
+    # Only needed for annotations; the Gemini SDK is configured and imported in pipeline.py
+    import google.generativeai as genai
 
-try:
-    synthesis_model = genai.GenerativeModel('gemini-2.5-flash') # Changed to gemini-2.5-flash as requested
-except Exception as e:
-    print(f"Could not initialize synthesis model: {e}")
-    print("Please ensure you have access to the specified Gemini model and your API key is correct.")
-    synthesis_model = None # Set to None if model initialization fails
 
-
-def agentic_rag_query(complex_query: str, collection, embedding_model, decomposition_model: genai.GenerativeModel, synthesis_model: genai.GenerativeModel, n_results_per_subquery: int = 3):
+@traced("agentic_rag_query")
+def agentic_rag_query(complex_query: str, collection, embedding_model, decomposition_model: "genai.GenerativeModel", synthesis_model: "genai.GenerativeModel", n_results_per_subquery: int = 3, on_token=None, pipelined: bool = PIPELINED_QUERIES,
+                      semantic_cache=None, fact_index=None):
     """
     Executes an agentic RAG query by decomposing the complex query, performing
     multi-step retrieval, and synthesizing the results.
@@ -27,9 +29,19 @@ def agentic_rag_query(complex_query: str, collection, embedding_model, decomposi
         decomposition_model: The Gemini model for query decomposition.
         synthesis_model: The Gemini model for synthesizing the final answer.
         n_results_per_subquery: The number of results to retrieve for each sub-query.
+        on_token: Optional callback; when given, the synthesis response is streamed and
+            each piece of text is passed to it as soon as the model produces it.
+        pipelined: If True, overlap retrieval with decomposition (see pipelined_retrieval)
+            and skip decomposition for simple single-company, single-year queries.
+        semantic_cache: Optional SemanticCache shared across queries, so near-identical
+            sub-queries reuse earlier retrieval results.
+        fact_index: Optional FactIndex. A query (or sub-query) asking for a single figure
+            reported in the filings' tables is answered from it instead of being retrieved;
+            when every sub-query is answered this way, synthesis is skipped.
 
     Returns:
-        A dictionary containing the question, answer, reasoning, sub-queries, and sources.
+        A dictionary containing the question, answer, reasoning, sub-queries, sources
+        and the per-stage `timings` of this call (see tracing.py).
     """
     if decomposition_model is None or synthesis_model is None:
         print("LLM models not initialized. Cannot perform agentic RAG query.")
@@ -41,40 +53,97 @@ def agentic_rag_query(complex_query: str, collection, embedding_model, decomposi
             "sources": []
         }
 
-    # Step 1: Query Decomposition
-    print("Performing query decomposition...")
-    sub_queries = decompose_query(complex_query, decomposition_model)
-    print(f"Decomposed into sub-queries: {sub_queries}")
+    # A lookup of one reported figure needs neither decomposition nor retrieval
+    direct_answer = lookup_facts([complex_query], fact_index)[0]
+    if direct_answer is not None:
+        print("Query answered from the fact index; skipping decomposition.")
+        sub_queries, batch_sources, fact_answers = [complex_query], [[]], [direct_answer]
+    elif pipelined and is_simple_query(complex_query):
+        # One company, one year, nothing to compare: the query is its own only sub-query
+        print("Simple query; skipping decomposition.")
+        sub_queries = [complex_query]
+        fact_answers = [None]
+        with span("retrieval", sub_queries=1):
+            batch_sources = rag_query_batch(sub_queries, collection, embedding_model, n_results=n_results_per_subquery, infer_filters=True,
+                                            semantic_cache=semantic_cache)
+    elif pipelined:
+        print("Performing pipelined decomposition and retrieval...")
+        sub_queries, batch_sources, fact_answers = pipelined_retrieval(complex_query, collection, embedding_model, decomposition_model,
+                                                                       n_results_per_subquery, semantic_cache, fact_index)
+    else:
+        # Step 1: Query Decomposition
+        print("Performing query decomposition...")
+        with span("decomposition") as attributes:
+            sub_queries = decompose_query(complex_query, decomposition_model)
+            attributes["sub_queries"] = len(sub_queries)
+        print(f"Decomposed into sub-queries: {sub_queries}")
+
+        # Step 2: Multi-step Retrieval
+        print("Performing multi-step retrieval...")
+        # Sub-queries the fact index answers are not retrieved
+        fact_answers = lookup_facts(sub_queries, fact_index)
+        pending = [i for i, answer in enumerate(fact_answers) if answer is None]
+        # Encode and search all sub-queries in one batch instead of one round trip each
+        # Each sub-query only searches the filings of the companies / years it mentions
+        with span("retrieval", sub_queries=len(pending)):
+            retrieved = rag_query_batch([sub_queries[i] for i in pending], collection, embedding_model, n_results=n_results_per_subquery, infer_filters=True,
+                                        semantic_cache=semantic_cache)
+        batch_sources = [[] for _ in sub_queries]
+        for i, sources in zip(pending, retrieved):
+            batch_sources[i] = sources
+    for sub_query, retrieved_sources, fact_answer in zip(sub_queries, batch_sources, fact_answers):
+        if fact_answer is not None:
+            print(f"Answered sub-query from the fact index: {sub_query}")
+        else:
+            print(f"Retrieved {len(retrieved_sources)} sources for sub-query: {sub_query}")
 
-    # Step 2: Multi-step Retrieval
-    print("Performing multi-step retrieval...")
-    all_retrieved_sources = []
-    for sub_query in sub_queries:
-        print(f"Retrieving for sub-query: {sub_query}")
-        retrieved_sources = rag_query(sub_query, collection, embedding_model, n_results=n_results_per_subquery)
-        all_retrieved_sources.extend(retrieved_sources)
+    facts = [answer for answer in fact_answers if answer is not None]
+    if facts and len(facts) == len(sub_queries):
+        # Every sub-query asked for a reported figure: answer from the index without a synthesis call
+        print("All sub-queries answered from the fact index; skipping synthesis.")
+        final_answer = " ".join(fact["answer"] for fact in facts)
+        if on_token is not None:
+            on_token(final_answer)
+            print() # End the streamed line
+        return {
+            "question": complex_query,
+            "answer": final_answer,
+            "reasoning": "Answered directly from the figures reported in the filings' tables (fact index); "
+                         "each figure cites its filing and page.",
+            "sub_queries": sub_queries,
+            "sources": [fact["source"] for fact in facts]
+        }
 
     # Prepare combined context and structured sources for synthesis and output
-    combined_context = ""
-    structured_sources = []
-    for source in all_retrieved_sources:
-        # Extract company and year from filename (assuming filename format like 'company-10-k-year.pdf')
-        filename = source['metadata'].get('source', '')
-        match = re.match(r'([a-zA-Z]+)-10-k-(\d{4})\.pdf', filename)
-        company = match.group(1).upper() if match else filename
-        year = match.group(2) if match else 'N/A'
-
-        structured_sources.append({
-            "company": company,
-            "year": year,
-            "excerpt": source['content'],
-            "page": source['metadata'].get('page_number', 'N/A')
-        })
-        combined_context += f"Source: {company} ({year}), Page: {source['metadata'].get('page_number', 'N/A')}\nContent: {source['content']}\n\n"
+    # Duplicates are dropped, neighbouring chunks merged and the best passages packed into
+    # CONTEXT_TOKEN_BUDGET, so structured_sources lists exactly the passages sent to synthesis
+    with span("context_assembly", retrieved=sum(len(sources) for sources in batch_sources)) as attributes:
+        passages = assemble_context(batch_sources)
+        combined_context = ""
+        structured_sources = []
+        for fact in facts:
+            # Figures answered from the fact index go first, with their page citations
+            source = fact["source"]
+            structured_sources.append(source)
+            combined_context += f"Source: {source['company']} ({source['year']}), Page: {source['page']}\nContent: {source['excerpt']}\n\n"
+        for passage in passages:
+            # Company and fiscal year are normalized into the chunk metadata at ingest
+            company = passage['metadata'].get('company', passage['metadata'].get('source', 'N/A'))
+            year = str(passage['metadata'].get('fiscal_year', 'N/A'))
+
+            structured_sources.append({
+                "company": company,
+                "year": year,
+                "excerpt": passage['content'],
+                "page": passage['pages'] # A "first-last" range when merged chunks span pages
+            })
+            combined_context += f"Source: {company} ({year}), Page: {passage['pages']}\nContent: {passage['content']}\n\n"
+        attributes.update(sources=len(structured_sources), context_chars=len(combined_context))
 
 
     # Step 3: Synthesis
     print("Synthesizing final answer...")
+    failed = False # Marks the result so a resumed --stream run retries the query
     try:
         synthesis_prompt = f"""\
         You are an expert financial assistant. You are given a user query and a set of retrieved context chunks that contain relevant information.
@@ -103,24 +172,42 @@ def agentic_rag_query(complex_query: str, collection, embedding_model, decomposi
 
         JSON Output:
         """
-        synthesis_response = synthesis_model.generate_content(synthesis_prompt)
-        synthesis_output = synthesis_response.text.strip()
+        with span("synthesis", prompt_chars=len(synthesis_prompt), streamed=on_token is not None) as attributes:
+            if on_token is None:
+                synthesis_response = synthesis_model.generate_content(synthesis_prompt)
+                synthesis_output = synthesis_response.text.strip()
+            else:
+                pieces = []
+                start = time.perf_counter()
+                for chunk in synthesis_model.generate_content(synthesis_prompt, stream=True):
+                    if not pieces:
+                        attributes["first_token_seconds"] = time.perf_counter() - start
+                    pieces.append(chunk.text)
+                    on_token(chunk.text)
+                synthesis_output = "".join(pieces).strip()
+                print() # End the streamed line
+            attributes["response_chars"] = len(synthesis_output)
 
         # Attempt to parse the JSON output
         try:
-            parsed_output = json.loads(synthesis_output.strip('```json').strip('```')
+            parsed_output = json.loads(synthesis_output.strip('```json').strip('```'))
             final_answer = parsed_output.get("answer", "Answer not found in JSON.")
             synthesis_reasoning = parsed_output.get("reasoning", "Reasoning not found in JSON.")
         except json.JSONDecodeError as e:
             print(f"Error decoding JSON from synthesis model: {e}")
             print(f"Synthesis output: {synthesis_output}")
             final_answer = "Error: Could not parse synthesis model output as JSON."
+            failed = True
             synthesis_reasoning = f"Error decoding JSON: {e}. Raw output: {synthesis_output}"
+            forget = getattr(synthesis_model, "forget", None) # Only a CachedModel has one
+            if forget is not None:
+                forget(synthesis_prompt) # Otherwise a rerun would get the same output from the LLM cache
 
         print("Synthesis complete.")
     except Exception as e:
         print(f"Error during synthesis: {e}")
         final_answer = "Error during synthesis."
+        failed = True
         synthesis_reasoning = f"Error during synthesis: {e}"
 
 
@@ -132,10 +219,68 @@ def agentic_rag_query(complex_query: str, collection, embedding_model, decomposi
         "sub_queries": sub_queries,
         "sources": structured_sources # Use the structured_sources list
     }
+    if failed:
+        result["error"] = True
 
     return result
 
+
+def lookup_facts(queries, fact_index):
+    """Answers each query from the fact index where it can; None for the others (or without an index)."""
+    if fact_index is None:
+        return [None] * len(queries)
+    with span("fact_lookup", queries=len(queries)) as attributes:
+        answers = [fact_index.lookup(query) for query in queries]
+        attributes["answered"] = sum(answer is not None for answer in answers)
+    return answers
+
+
+def pipelined_retrieval(complex_query, collection, embedding_model, decomposition_model, n_results_per_subquery=3,
+                        semantic_cache=None, fact_index=None):
+    """
+    Overlaps retrieval with query decomposition.
+
+    Retrieval for the original query starts before the decomposition request is
+    sent, and each sub-query is retrieved as soon as its line of the streamed
+    decomposition arrives, unless the fact index answers it. The speculative
+    results for the original query are returned alongside the sub-queries' so
+    synthesis can use them too.
+
+    Returns:
+        (sub_queries, batch_sources, fact_answers): the parsed sub-queries, the retrieved
+        sources of each sub-query (empty when answered from the fact index) followed by
+        those of the original query, and each sub-query's fact index answer or None.
+    """
+    def retrieve(query_text):
+        return rag_query_batch([query_text], collection, embedding_model, n_results=n_results_per_subquery, infer_filters=True,
+                               semantic_cache=semantic_cache)[0]
+
+    # Retrievals run in worker threads; copying the context keeps their spans in this query's trace
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        speculative = executor.submit(contextvars.copy_context().run, retrieve, complex_query)
+        sub_queries, futures, fact_answers = [], [], []
+        with span("decomposition", streamed=True) as attributes:
+            for sub_query in iter_sub_queries(complex_query, decomposition_model):
+                sub_queries.append(sub_query)
+                fact_answers.append(lookup_facts([sub_query], fact_index)[0])
+                if fact_answers[-1] is None:
+                    futures.append(executor.submit(contextvars.copy_context().run, retrieve, sub_query))
+                else:
+                    futures.append(None)
+            attributes["sub_queries"] = len(sub_queries)
+        print(f"Decomposed into sub-queries: {sub_queries}")
+        with span("retrieval_wait", sub_queries=len(sub_queries)):
+            batch_sources = [future.result() if future is not None else [] for future in futures] + [speculative.result()]
+    return sub_queries, batch_sources, fact_answers
+
+
 if __name__=="__main__":
+    from pipeline import load_embedding_model, open_collection, open_fact_index, load_llms
+
+    embedding_model = load_embedding_model()
+    collection = open_collection()
+    decomposition_model, synthesis_model, _ = load_llms()
     complex_query = "Compare the revenue growth and key risks of Microsoft and Google in 2023."
-    agentic_result_json = agentic_rag_query(complex_query, collection, embedding_model, decomposition_model, synthesis_model)
+    agentic_result_json = agentic_rag_query(complex_query, collection, embedding_model, decomposition_model, synthesis_model,
+                                            fact_index=open_fact_index())
     print(agentic_result_json)
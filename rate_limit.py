@@ -0,0 +1,109 @@
+import random
+import threading
+import time
+
+
+def retryable_exceptions():
+    """Transient API errors worth retrying: quota, overload and timeouts."""
+    try:
+        # Imported lazily; google.api_core pulls in grpc
+        from google.api_core import exceptions as google_exceptions
+    except ImportError:
+        return (ConnectionError, TimeoutError)
+    return (
+        google_exceptions.ResourceExhausted,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.DeadlineExceeded,
+        google_exceptions.InternalServerError,
+        ConnectionError,
+        TimeoutError,
+    )
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket allowing `rate` calls per second with bursts up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available, then consumes it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimitedModel:
+    """
+    Wraps a GenerativeModel so every generate_content call goes through a shared
+    token bucket and is retried with exponential backoff on transient errors.
+
+    Anything exposing generate_content(prompt) can be wrapped, which lets a local
+    stub stand in for genai.GenerativeModel.
+    """
+
+    def __init__(self, model, bucket=None, max_retries=4, base_delay=1.0, max_delay=30.0,
+                 retry_on=None):
+        self.model = model
+        self.bucket = bucket
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on = retry_on if retry_on is not None else retryable_exceptions()
+
+    def __getattr__(self, name):
+        # Expose the wrapped model's other attributes (e.g. model_name)
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def generate_content(self, prompt, **kwargs):
+        if kwargs.get("stream"):
+            return self.stream_content(prompt, **kwargs)
+        return self.with_retries(lambda: self.model.generate_content(prompt, **kwargs))
+
+    def stream_content(self, prompt, **kwargs):
+        """
+        Yields the chunks of a generate_content(stream=True) response.
+
+        Only failures before the first chunk are retried; retrying later would
+        repeat text the caller has already consumed.
+        """
+        def start_stream():
+            response = iter(self.model.generate_content(prompt, **kwargs))
+            return next(response, None), response
+
+        first_chunk, response = self.with_retries(start_stream)
+        if first_chunk is None:
+            return
+        yield first_chunk
+        yield from response
+
+    def with_retries(self, call):
+        attempt = 0
+        while True:
+            if self.bucket is not None:
+                self.bucket.acquire()
+            try:
+                return call()
+            except self.retry_on as e:
+                if attempt >= self.max_retries:
+                    raise
+                # Exponential backoff with jitter so concurrent workers don't retry in lockstep
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+                print(f"generate_content failed ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
@@ -0,0 +1,103 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from config import SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MAX_ENTRIES
+from manifest import manifest_path
+
+
+def collection_fingerprint(collection):
+    """
+    Identifies the state of a collection cheaply: its name, chunk count and ingest
+    manifest. Every ingest that changes the collection rewrites the manifest with a
+    new generation, so re-ingesting a filing that keeps the same number of chunks
+    still changes the fingerprint.
+    """
+    name = getattr(collection, "name", None)
+    try:
+        # Replaced atomically on save, so a new inode and mtime mark a new generation
+        stat = os.stat(manifest_path(name))
+        manifest_state = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    except (OSError, TypeError):
+        manifest_state = None # Not ingested by create_embeddings (e.g. a test collection)
+    return (name, collection.count(), manifest_state)
+
+
+class SemanticCache:
+    """
+    In-memory cache of retrieval results keyed by query embedding.
+
+    A lookup returns the results of an earlier query whose embedding has a cosine
+    similarity of at least `threshold` with the new one, provided both used the
+    same `where` filter and n_results. At most `max_entries` results are kept,
+    evicting the least recently used. All entries are dropped when the
+    collection's fingerprint (name, count, manifest) changes. Safe to share between threads.
+    """
+
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, max_entries=SEMANTIC_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # slot -> (group key, sources), least recently used first
+        self.groups = {} # (where, n_results) -> slots holding results for that filter
+        self.vectors = None # (max_entries, dim) normalized query embeddings, one row per slot
+        self.fingerprint = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def group_key(where, n_results):
+        return json.dumps(where, sort_keys=True), n_results
+
+    def check_fingerprint(self, fingerprint):
+        # Results may be stale once chunks were added or removed; must hold the lock
+        if fingerprint != self.fingerprint:
+            self.entries.clear()
+            self.groups.clear()
+            self.fingerprint = fingerprint
+
+    def get(self, embedding, where, n_results, fingerprint):
+        """Returns a copy of the cached sources for a similar query, or None."""
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        with self.lock:
+            self.check_fingerprint(fingerprint)
+            slots = self.groups.get(self.group_key(where, n_results))
+            if slots:
+                slots = list(slots)
+                similarities = self.vectors[slots] @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self.entries.move_to_end(slots[best])
+                    self.hits += 1
+                    return list(self.entries[slots[best]][1])
+            self.misses += 1
+            return None
+
+    def put(self, embedding, where, n_results, fingerprint, sources):
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        key = self.group_key(where, n_results)
+        with self.lock:
+            self.check_fingerprint(fingerprint)
+            if self.vectors is None or self.vectors.shape[1] != query.shape[0]:
+                self.vectors = np.zeros((self.max_entries, query.shape[0]), dtype=np.float32)
+                self.entries.clear()
+                self.groups.clear()
+
+            if len(self.entries) >= self.max_entries:
+                # Reuse the least recently used slot
+                slot, (old_key, _) = self.entries.popitem(last=False)
+                self.groups[old_key].discard(slot)
+            else:
+                slot = len(self.entries) # Slots fill up in order until the first eviction
+
+            self.vectors[slot] = query
+            self.entries[slot] = (key, list(sources))
+            self.groups.setdefault(key, set()).add(slot)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries),
+                "hit_rate": self.hits / lookups if lookups else None}
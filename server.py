@@ -0,0 +1,215 @@
+import argparse
+import json
+import threading
+import time
+import urllib.request
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import SERVER_HOST, SERVER_PORT, LLM_REQUESTS_PER_MINUTE, TRACE_SPAN_HOOKS, PIPELINED_QUERIES
+from tracing import load_span_hooks
+
+
+class LatencyStats:
+    """Thread-safe request counters and latency percentiles over a sliding window."""
+
+    def __init__(self, window=1000):
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds, error=False):
+        with self.lock:
+            self.latencies.append(seconds)
+            self.requests += 1
+            if error:
+                self.errors += 1
+
+    def snapshot(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            requests, errors = self.requests, self.errors
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(p / 100.0 * len(latencies)))]
+
+        return {
+            "requests": requests,
+            "errors": errors,
+            "latency_seconds": {
+                "mean": sum(latencies) / len(latencies) if latencies else None,
+                "p50": percentile(50),
+                "p95": percentile(95),
+                "p99": percentile(99),
+            },
+        }
+
+
+class RAGServer(ThreadingHTTPServer):
+    """
+    HTTP server that keeps the embedding model, collection and LLM clients
+    resident and answers agentic_rag_query requests concurrently.
+
+    Endpoints:
+        POST /query   {"query": "...", "n_results_per_subquery": 3, "pipelined": false} -> result dict
+        GET  /health  status, uptime, collection size, latency and cache stats
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, collection, embedding_model, decomposition_model, synthesis_model, llm_cache=None,
+                 pipelined=PIPELINED_QUERIES, semantic_cache=None, fact_index=None):
+        super().__init__(address, RAGRequestHandler)
+        # Imported here so thin clients importing query_server stay lightweight
+        from rag_agent import agentic_rag_query
+        self.agentic_rag_query = agentic_rag_query
+        self.collection = collection
+        self.embedding_model = embedding_model
+        self.decomposition_model = decomposition_model
+        self.synthesis_model = synthesis_model
+        self.llm_cache = llm_cache
+        self.semantic_cache = semantic_cache
+        self.fact_index = fact_index
+        self.pipelined = pipelined # Default for requests that don't set "pipelined"
+        self.stats = LatencyStats()
+        self.started = time.time()
+
+    def health(self):
+        health = {
+            "status": "ok",
+            "uptime_seconds": time.time() - self.started,
+            "collection": getattr(self.collection, "name", None),
+            "chunks": self.collection.count(),
+        }
+        health.update(self.stats.snapshot())
+        if self.llm_cache is not None:
+            health["llm_cache"] = self.llm_cache.stats()
+        if self.semantic_cache is not None:
+            health["semantic_cache"] = self.semantic_cache.stats()
+        if self.fact_index is not None:
+            health["fact_index"] = self.fact_index.stats()
+        return health
+
+
+class RAGRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, self.server.health())
+        else:
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/query":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            query = request["query"]
+        except (ValueError, KeyError) as e:
+            self.send_json(400, {"error": f"Expected a JSON body with a 'query' field: {e}"})
+            return
+
+        start = time.perf_counter()
+        try:
+            result = self.server.agentic_rag_query(
+                query, self.server.collection, self.server.embedding_model,
+                self.server.decomposition_model, self.server.synthesis_model,
+                n_results_per_subquery=request.get("n_results_per_subquery", 3),
+                pipelined=request.get("pipelined", self.server.pipelined),
+                semantic_cache=self.server.semantic_cache,
+                fact_index=self.server.fact_index
+            )
+        except Exception as e:
+            self.server.stats.record(time.perf_counter() - start, error=True)
+            self.send_json(500, {"error": f"Error processing query: {e}"})
+            return
+        self.server.stats.record(time.perf_counter() - start)
+        self.send_json(200, result)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Per-request access logs would drown out the query progress output
+
+
+def query_server(server_url, query, timeout=600):
+    """Sends one query to a running RAGServer and returns the result dictionary."""
+    request = urllib.request.Request(
+        server_url.rstrip("/") + "/query",
+        data=json.dumps({"query": query}).encode('utf-8'),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve Agentic RAG queries over HTTP with warm models.")
+    parser.add_argument("--host", type=str, default=SERVER_HOST, help="Interface to bind to")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="Port to listen on")
+    parser.add_argument(
+        "--requests_per_minute",
+        type=float,
+        default=LLM_REQUESTS_PER_MINUTE,
+        help="Rate limit shared by all Gemini generate_content calls"
+    )
+    parser.add_argument(
+        "--no_llm_cache",
+        action="store_true",
+        help="Bypass the local LLM response cache and always call Gemini"
+    )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        default=PIPELINED_QUERIES,
+        help="Retrieve while the decomposition streams in, and skip decomposition for simple queries"
+    )
+    parser.add_argument(
+        "--no_semantic_cache",
+        action="store_true",
+        help="Search the collection for every sub-query, even near-duplicates of earlier ones"
+    )
+    parser.add_argument(
+        "--no_fact_index",
+        action="store_true",
+        help="Answer every query through retrieval and synthesis, even lookups of single reported figures"
+    )
+    args = parser.parse_args()
+    load_span_hooks(TRACE_SPAN_HOOKS)
+
+    from pipeline import load_embedding_model, open_collection, open_fact_index, load_llms
+    from semantic_cache import SemanticCache
+
+    collection = open_collection()
+    if collection is None:
+        print("Collection not found; run `python embedding.py` first.")
+        return
+    embedding_model = load_embedding_model()
+    decomposition_model, synthesis_model, llm_cache = load_llms(args.requests_per_minute, not args.no_llm_cache)
+
+    server = RAGServer((args.host, args.port), collection, embedding_model,
+                       decomposition_model, synthesis_model, llm_cache, pipelined=args.pipelined,
+                       semantic_cache=None if args.no_semantic_cache else SemanticCache(),
+                       fact_index=None if args.no_fact_index else open_fact_index())
+    print(f"Serving Agentic RAG on http://{args.host}:{args.port} (POST /query, GET /health)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import builtins
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Dependencies whose presence in sys.modules is reported by --profile-startup
+HEAVY_MODULES = ('unstructured', 'torch', 'sentence_transformers', 'chromadb', 'google.generativeai')
+
+
+class StartupProfiler:
+    """
+    Records where a main.py run spends its time before answering anything.
+
+    Tracks named setup phases, the cost of every first-time top-level import
+    (including lazy imports inside functions) and the time until the first
+    retrieval reaches the collection.
+    """
+
+    def __init__(self, start):
+        self.start = start
+        self.phases = []
+        self.imports = {}
+        self.first_retrieval = None
+        self.original_import = None
+        self.lock = threading.Lock()
+
+    def install_import_timer(self):
+        """Wraps builtins.__import__ to time modules the first time they are imported."""
+        self.original_import = builtins.__import__
+        original_import = self.original_import
+        local = threading.local()
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            # Only time absolute imports at the outermost level; nested imports are part of their parent
+            if level or getattr(local, "depth", 0) or name in sys.modules:
+                return original_import(name, globals, locals, fromlist, level)
+            local.depth = 1
+            start = time.perf_counter()
+            try:
+                return original_import(name, globals, locals, fromlist, level)
+            finally:
+                local.depth = 0
+                with self.lock:
+                    self.imports[name] = self.imports.get(name, 0.0) + time.perf_counter() - start
+
+        builtins.__import__ = timed_import
+
+    def uninstall_import_timer(self):
+        if self.original_import is not None:
+            builtins.__import__ = self.original_import
+            self.original_import = None
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def watch_collection(self, collection):
+        """Returns a proxy of `collection` that records when the first query is issued."""
+        return FirstQueryProxy(collection, self)
+
+    def mark_first_retrieval(self):
+        with self.lock:
+            if self.first_retrieval is None:
+                self.first_retrieval = time.perf_counter() - self.start
+
+    def report(self):
+        print("\n=== Startup profile ===")
+        for name, seconds in self.phases:
+            print(f"{name:<40} {seconds:8.3f}s")
+        if self.first_retrieval is not None:
+            print(f"{'time to first retrieval':<40} {self.first_retrieval:8.3f}s")
+        print("Slowest first-time imports:")
+        for name, seconds in sorted(self.imports.items(), key=lambda item: -item[1])[:10]:
+            print(f"  {name:<38} {seconds:8.3f}s")
+        loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+        print(f"Heavy modules loaded: {', '.join(loaded) if loaded else 'none'}")
+
+
+class FirstQueryProxy:
+    """Delegates to a collection, notifying the profiler on the first query() call."""
+
+    def __init__(self, collection, profiler):
+        self.collection = collection
+        self.profiler = profiler
+
+    def __getattr__(self, name):
+        if name == "collection":
+            raise AttributeError(name)
+        return getattr(self.collection, name)
+
+    def query(self, *args, **kwargs):
+        self.profiler.mark_first_retrieval()
+        return self.collection.query(*args, **kwargs)
@@ -0,0 +1,182 @@
+import bisect
+import contextvars
+import functools
+import importlib
+import threading
+import time
+from contextlib import contextmanager
+
+# Trace of the agentic_rag_query call running in the current thread / context
+current_trace = contextvars.ContextVar("current_trace", default=None)
+# Innermost open span, so nested code (e.g. the LLM cache) can annotate it
+current_span = contextvars.ContextVar("current_span", default=None)
+
+# Callables invoked with each finished span's dict; see add_span_hook
+SPAN_HOOKS = []
+
+
+class Trace:
+    """
+    Collects timed spans for one query.
+
+    Spans are recorded with their name, parent, start offset, duration and free-form
+    attributes (sizes, counts, cache hits). Use the module-level span() helper
+    inside code that may run with or without an active trace.
+    """
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.start = time.perf_counter()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def finish(self, span_record):
+        with self.lock:
+            self.spans.append(span_record)
+        for hook in list(SPAN_HOOKS):
+            try:
+                hook(dict(span_record, trace=self.name))
+            except Exception as e:
+                print(f"Span hook {hook} failed: {e}")
+
+    def to_dict(self):
+        """Returns the timings attached to query results under the `timings` key."""
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span_record: span_record["start_seconds"])
+        return {
+            "total_seconds": time.perf_counter() - self.start,
+            "spans": spans,
+        }
+
+
+@contextmanager
+def trace(name, **attributes):
+    """Starts a Trace and makes it current for the duration of the block."""
+    new_trace = Trace(name, **attributes)
+    token = current_trace.set(new_trace)
+    try:
+        yield new_trace
+    finally:
+        current_trace.reset(token)
+
+
+def traced(name):
+    """
+    Decorator running the function under a new Trace. When it returns a dict,
+    the trace's timings are attached to it under the `timings` key.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with trace(name) as function_trace:
+                result = function(*args, **kwargs)
+            if isinstance(result, dict):
+                result["timings"] = function_trace.to_dict()
+            return result
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Times a block as a span of the current trace. Does nothing without an active trace.
+
+    Yields the span's attribute dict so the block can add sizes or counts to it.
+    """
+    active_trace = current_trace.get()
+    if active_trace is None:
+        yield attributes
+        return
+
+    parent = current_span.get()
+    span_record = {"name": name, "parent": parent["name"] if parent else None, "attributes": attributes}
+    token = current_span.set(span_record)
+    start = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        end = time.perf_counter()
+        current_span.reset(token)
+        span_record["start_seconds"] = start - active_trace.start
+        span_record["seconds"] = end - start
+        active_trace.finish(span_record)
+
+
+def annotate(**attributes):
+    """Adds attributes to the innermost open span, if any."""
+    open_span = current_span.get()
+    if open_span is not None:
+        open_span["attributes"].update(attributes)
+
+
+def add_span_hook(hook):
+    """Registers hook(span_dict), called for every finished span, e.g. to forward it to a collector."""
+    SPAN_HOOKS.append(hook)
+
+
+def remove_span_hook(hook):
+    if hook in SPAN_HOOKS:
+        SPAN_HOOKS.remove(hook)
+
+
+def load_span_hooks(paths):
+    """Registers hooks given as 'package.module:function' strings (see TRACE_SPAN_HOOKS in config.py)."""
+    for path in paths:
+        module_name, _, function_name = path.partition(":")
+        add_span_hook(getattr(importlib.import_module(module_name), function_name))
+
+
+class MetricsRegistry:
+    """
+    Aggregates span durations across a batch of queries into histograms.
+
+    Each span name (plus the query total) gets cumulative bucket counts, a sum
+    and approximate percentiles, in the layout of a Prometheus histogram.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.setdefault(name, {"counts": [0] * (len(self.BUCKETS) + 1), "sum": 0.0, "samples": []})
+            histogram["counts"][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+            histogram["sum"] += seconds
+            histogram["samples"].append(seconds)
+
+    def observe_timings(self, timings):
+        """Records the total and every span of one result's `timings` dict."""
+        if not timings:
+            return
+        self.observe("query_total", timings["total_seconds"])
+        for span_record in timings["spans"]:
+            self.observe(span_record["name"], span_record["seconds"])
+
+    def snapshot(self):
+        snapshot = {}
+        with self.lock:
+            for name, histogram in self.histograms.items():
+                samples = sorted(histogram["samples"])
+                cumulative, buckets = 0, {}
+                for bound, count in zip(self.BUCKETS + (float("inf"),), histogram["counts"]):
+                    cumulative += count
+                    buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+                snapshot[name] = {
+                    "count": len(samples),
+                    "sum_seconds": histogram["sum"],
+                    "p50_seconds": samples[int(0.50 * (len(samples) - 1))],
+                    "p95_seconds": samples[int(0.95 * (len(samples) - 1))],
+                    "buckets": buckets,
+                }
+        return snapshot
+
+    def report(self):
+        print("\n=== Stage timings ===")
+        for name, metrics in sorted(self.snapshot().items(), key=lambda item: -item[1]["sum_seconds"]):
+            print(f"{name:<24} n={metrics['count']:<5} total={metrics['sum_seconds']:8.3f}s "
+                  f"p50={metrics['p50_seconds']:.3f}s p95={metrics['p95_seconds']:.3f}s")
@@ -0,0 +1,218 @@
+import json
+import os
+import numpy as np
+from config import (COLLECTION_NAME, CHROMA_PATH, NUMPY_INDEX_DIR, NUMPY_INDEX_DTYPE,
+                    NUMPY_RESCORE_FACTOR)
+
+# Rows scored per block when the search matrix is stored in reduced precision,
+# so the float32 upcast never materializes the whole matrix
+BLOCK_ROWS = 8192
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def matches_where(metadata, where):
+    """Evaluates a ChromaDB-style `where` filter against one metadata dictionary."""
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for operator, operand in condition.items():
+                if operator == "$eq" and not value == operand:
+                    return False
+                if operator == "$ne" and not value != operand:
+                    return False
+                if operator == "$in" and value not in operand:
+                    return False
+                if operator == "$nin" and value in operand:
+                    return False
+                if operator in ("$gt", "$gte", "$lt", "$lte"):
+                    if value is None:
+                        return False
+                    if operator == "$gt" and not value > operand:
+                        return False
+                    if operator == "$gte" and not value >= operand:
+                        return False
+                    if operator == "$lt" and not value < operand:
+                        return False
+                    if operator == "$lte" and not value <= operand:
+                        return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+class NumpyIndex:
+    """
+    In-process, read-only vector index that can stand in for a ChromaDB collection.
+
+    Embeddings are stored L2-normalized as memory-mapped .npy files and ranked by
+    dot product (cosine similarity). The search matrix can be kept in float16 or
+    int8 (with a per-row scale) to shrink the resident size at the cost of an
+    upcast per query, which makes them slower than float32; the top
+    `n_results * rescore_factor` candidates are then re-scored against the
+    full-precision matrix, which is only touched for those rows.
+
+    Implements the subset of the collection API used by rag.py: query() and count().
+    """
+
+    def __init__(self, index_dir, rescore_factor=NUMPY_RESCORE_FACTOR):
+        with open(os.path.join(index_dir, "meta.json"), 'r') as f:
+            meta = json.load(f)
+        self.name = meta["name"]
+        self.dtype = meta["dtype"]
+        self.rescore_factor = rescore_factor
+
+        # Memory-mapped so loading is near-instant and pages are read on demand
+        self.vectors = np.load(os.path.join(index_dir, "vectors.npy"), mmap_mode='r')
+        if self.dtype == "float32":
+            self.search_vectors = self.vectors
+            self.scales = None
+        else:
+            self.search_vectors = np.load(os.path.join(index_dir, f"vectors_{self.dtype}.npy"), mmap_mode='r')
+            self.scales = np.load(os.path.join(index_dir, "scales.npy")) if self.dtype == "int8" else None
+
+        with open(os.path.join(index_dir, "records.json"), 'r') as f:
+            records = json.load(f)
+        self.ids = records["ids"]
+        self.documents = records["documents"]
+        self.metadatas = records["metadatas"]
+        self.mask_cache = {}
+
+    def count(self):
+        return len(self.ids)
+
+    def query(self, query_embeddings, n_results=10, where=None, include=('documents', 'metadatas', 'distances')):
+        queries = normalize_rows(query_embeddings)
+        scores = self.coarse_scores(queries)
+
+        mask = self.where_mask(where)
+        if mask is not None:
+            scores[~mask] = -np.inf
+        available = len(self.ids) if mask is None else int(mask.sum())
+        n_results = min(n_results, available)
+
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for column, query in enumerate(queries):
+            column_scores = scores[:, column]
+            if n_results <= 0:
+                top = np.array([], dtype=np.int64)
+                top_scores = np.array([], dtype=np.float32)
+            else:
+                # Shortlist on the (possibly quantized) scores, then re-score in full precision
+                n_candidates = min(available, n_results * self.rescore_factor)
+                candidates = np.argpartition(-column_scores, n_candidates - 1)[:n_candidates]
+                if self.search_vectors is not self.vectors:
+                    candidates = np.sort(candidates) # Sorted rows keep the mmap reads sequential
+                    candidate_scores = np.asarray(self.vectors[candidates], dtype=np.float32) @ query
+                else:
+                    candidate_scores = column_scores[candidates]
+                order = np.argsort(-candidate_scores)[:n_results]
+                top = candidates[order]
+                top_scores = candidate_scores[order]
+
+            results["ids"].append([self.ids[i] for i in top])
+            if 'documents' in include:
+                results["documents"].append([self.documents[i] for i in top])
+            if 'metadatas' in include:
+                results["metadatas"].append([self.metadatas[i] for i in top])
+            if 'distances' in include:
+                results["distances"].append([float(1.0 - score) for score in top_scores]) # Cosine distance
+
+        return {key: value for key, value in results.items() if key == "ids" or key in include}
+
+    def coarse_scores(self, queries):
+        """Returns an (N, Q) float32 matrix of approximate similarities."""
+        if not self.ids:
+            return np.zeros((0, len(queries)), dtype=np.float32)
+        if self.dtype == "float32":
+            return np.asarray(self.search_vectors @ queries.T, dtype=np.float32)
+
+        scores = np.empty((len(self.ids), len(queries)), dtype=np.float32)
+        for start in range(0, len(self.ids), BLOCK_ROWS):
+            block = np.asarray(self.search_vectors[start:start + BLOCK_ROWS], dtype=np.float32)
+            scores[start:start + BLOCK_ROWS] = block @ queries.T
+        if self.scales is not None:
+            scores *= self.scales[:, None]
+        return scores
+
+    def where_mask(self, where):
+        if not where:
+            return None
+        key = json.dumps(where, sort_keys=True)
+        mask = self.mask_cache.get(key)
+        if mask is None:
+            mask = np.fromiter((matches_where(metadata, where) for metadata in self.metadatas),
+                               dtype=bool, count=len(self.metadatas))
+            self.mask_cache[key] = mask
+        return mask
+
+
+def export_chroma_collection(collection, index_dir, dtype=NUMPY_INDEX_DTYPE, page_size=1000):
+    """
+    Exports a ChromaDB collection into a NumpyIndex directory.
+
+    Args:
+        collection: The ChromaDB collection to export.
+        index_dir: Output directory.
+        dtype: Storage for the search matrix: 'float32', 'float16' or 'int8'.
+        page_size: Number of records fetched from ChromaDB per request.
+    """
+    ids, documents, metadatas, vectors = [], [], [], []
+    total = collection.count()
+    for offset in range(0, total, page_size):
+        page = collection.get(include=['embeddings', 'documents', 'metadatas'], limit=page_size, offset=offset)
+        ids.extend(page["ids"])
+        documents.extend(page["documents"])
+        metadatas.extend(page["metadatas"])
+        vectors.append(np.asarray(page["embeddings"], dtype=np.float32))
+
+    vectors = np.concatenate(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+    write_numpy_index(index_dir, collection.name, ids, documents, metadatas, vectors, dtype)
+    print(f"Exported {len(ids)} embeddings from '{collection.name}' to {index_dir} ({dtype}).")
+
+
+def write_numpy_index(index_dir, name, ids, documents, metadatas, vectors, dtype=NUMPY_INDEX_DTYPE):
+    """Writes records and their embeddings (normalized here) as a NumpyIndex directory."""
+    if dtype not in ("float32", "float16", "int8"):
+        raise ValueError(f"Unsupported index dtype: {dtype}")
+
+    os.makedirs(index_dir, exist_ok=True)
+    meta_path = os.path.join(index_dir, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path) # Invalidate the old index until the new one is complete
+
+    vectors = normalize_rows(vectors) if len(vectors) else np.zeros((0, 0), dtype=np.float32)
+    np.save(os.path.join(index_dir, "vectors.npy"), vectors)
+    if dtype == "float16":
+        np.save(os.path.join(index_dir, "vectors_float16.npy"), vectors.astype(np.float16))
+    elif dtype == "int8":
+        # Symmetric per-row quantization: row ~= int8_row * scale
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+        quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        np.save(os.path.join(index_dir, "vectors_int8.npy"), quantized)
+        np.save(os.path.join(index_dir, "scales.npy"), scales.astype(np.float32))
+
+    with open(os.path.join(index_dir, "records.json"), 'w') as f:
+        json.dump({"ids": ids, "documents": documents, "metadatas": metadatas}, f)
+    # Written last so a partially written directory is never picked up
+    with open(meta_path, 'w') as f:
+        json.dump({"name": name, "dtype": dtype, "count": len(ids)}, f)
+
+
+if __name__ == "__main__":
+    import chromadb
+
+    client = chromadb.PersistentClient(path=CHROMA_PATH)
+    export_chroma_collection(client.get_collection(COLLECTION_NAME), NUMPY_INDEX_DIR)